@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+'''
+Usage:
+    aws-frederick-bench.py [--config-file <FILE_LOCATION>] [--baseline <BASELINE_FILE>]
+    [--sizes <SIZES>] [--subsystems <SUBSYSTEMS>] [--tolerance <PERCENT>]
+    [--update-baseline]
+
+Options:
+  -h --help                            Show this screen.
+  --config-file <CONFIG_FILE>          Config providing the non aws_frederick
+                                       sections [default: 2018-config.yaml].
+  --baseline <BASELINE_FILE>           Stored results to compare against
+                                       [default: bench-baseline.json].
+  --sizes <SIZES>                      Comma separated fixture sizes
+                                       [default: 1,10,100].
+  --subsystems <SUBSYSTEMS>            Comma separated subsystems
+                                       [default: rds,ecs,buckets,security_groups].
+  --tolerance <PERCENT>                Allowed growth over the baseline before
+                                       a case is a regression [default: 25].
+  --update-baseline                    Write the results as the new baseline.
+'''
+
+from aws_frederick_common import AWSFrederickCommonTemplate
+from multiprocessing import Process, Queue
+from docopt import docopt
+import traceback
+import tempfile
+import resource
+import shutil
+import json
+import time
+import yaml
+import imp
+import sys
+import os
+
+# aws-frederick-env.py is a script, load it by path for its controller class
+AWSFrederickEnv = imp.load_source(
+    'aws_frederick_env',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aws-frederick-env.py')
+).AWSFrederickEnv
+
+
+class AWSFrederickBenchSecurityGroupTemplate(AWSFrederickCommonTemplate):
+    """
+    Bench only child template building one security group per configured
+    port list, the environment has no config driven equivalent
+    """
+
+    def __init__(self, env_name, region, cidr_range, aws_frederick_config):
+        super(AWSFrederickBenchSecurityGroupTemplate, self).__init__('AWSFrederickBenchSecurityGroups')
+
+        self.env_name = env_name
+        self.region = region
+        self.cidr_range = cidr_range
+        self.config = aws_frederick_config
+
+    def build_hook(self):
+        for index, ports in enumerate(self.config.get('security_groups')):
+            self.add_sg_with_cidr_port_list(
+                'BenchSG%d' % index,
+                'Security Group for benchmarking port lists',
+                'vpcId',
+                self.cidr_range,
+                ports
+            )
+
+
+class AWSFrederickBenchView(object):
+    """
+    Stands in for the CLI. Runs the create action up to the child builds,
+    offline and without serializing, and times each child template
+    """
+
+    def __init__(self, key_file, subsystem):
+        """
+        @param key_file [string] offline key file for the fixture secrets
+        @param subsystem [string] subsystem being benchmarked
+        """
+        self.config_filename = None
+        self.key_file = key_file
+        self.subsystem = subsystem
+        self.results = {}
+
+    def update_config(self, config):
+        config['global']['offline'] = True
+        config['global']['key_file'] = self.key_file
+        config['global']['print_debug'] = False
+        config['global']['monitor_stack'] = False
+        config['template']['s3_upload'] = False
+
+    def process_request(self, controller):
+        controller.load_config()
+        controller.initialize_template()
+        controller.create_hook()
+
+        if self.subsystem == 'security_groups':
+            env_name = controller.globals.get('environment_name')
+            network = controller.config.get('network')
+            controller.add_child_template(AWSFrederickBenchSecurityGroupTemplate(
+                env_name,
+                controller.config.get('boto').get('region_name'),
+                network.get('network_cidr_base') + '/' + network.get('network_cidr_size'),
+                controller.config.get('aws_frederick')
+            ))
+
+        for child, merge, _, _, _ in controller.template._child_templates:
+            if merge or not isinstance(child, AWSFrederickCommonTemplate):
+                continue
+
+            start = time.time()
+            child.prebuild(controller.template)
+            build_seconds = time.time() - start
+
+            self.results[child.name] = {
+                'build_seconds': round(build_seconds, 4),
+                'template_bytes': len(child.to_json()),
+                'resources': len(child.resources)
+            }
+
+
+class AWSFrederickBench(object):
+    """
+    Builds each child template against synthetic configs of increasing size
+    and compares build time, peak memory and rendered size to a baseline
+    """
+
+    # Metrics compared against the baseline and the absolute growth each is
+    # allowed before the relative tolerance applies, so timer noise on tiny
+    # fixtures is not reported
+    METRIC_FLOORS = {
+        'build_seconds': 0.05,
+        'peak_rss_kb': 8192,
+        'template_bytes': 0
+    }
+
+    def __init__(self, base_config, tolerance=25):
+        """
+        @param base_config [dict] config supplying the environmentbase sections
+        @param tolerance [int] percent growth over the baseline allowed per metric
+        """
+        self.base_config = base_config
+        self.tolerance = tolerance
+        self.secrets = {}
+
+    def secret(self, name):
+        ciphertext = 'bench-%s' % name
+        self.secrets[ciphertext] = 'bench-%s-password' % name
+        return ciphertext
+
+    def fixture(self, subsystem, size):
+        """
+        Returns an aws_frederick config section with size entries of the
+        given subsystem
+        @param subsystem [string] rds, ecs, buckets or security_groups
+        @param size [int] number of entries
+        """
+        aws_frederick = {
+            'hosted_zone': 'filesharefrederick.net.',
+            'public_hosted_zone': 'filesharefrederick.net.'
+        }
+
+        if subsystem == 'rds':
+            aws_frederick['rds'] = [{
+                'name': 'database%d' % ii,
+                'engine': 'mariadb',
+                'username': 'awsfred',
+                'password': self.secret('database%d' % ii),
+                'storage': '20',
+                'db_instance_type': 'db.t2.micro',
+                'multiaz': False
+            } for ii in range(size)]
+
+        elif subsystem == 'ecs':
+            aws_frederick['ecs'] = [{
+                'name': 'service%d' % ii,
+                'image': 'nginx',
+                'cpu': '512',
+                'memory': '1024',
+                'container_port': 80,
+                'alb_port': 80,
+                'envvars': {'SERVICE_INDEX': str(ii)}
+            } for ii in range(size)]
+
+        elif subsystem == 'buckets':
+            aws_frederick['buckets'] = [{
+                'name': 'awsfredbench%d' % ii,
+                'access_control': 'Private'
+            } for ii in range(size)]
+
+        elif subsystem == 'security_groups':
+            aws_frederick['security_groups'] = [
+                [{str(port): str(port)} for port in range(8000, 8000 + size)]
+            ]
+
+        return aws_frederick
+
+    def run_case(self, subsystem, size, key_file, queue):
+        """
+        Child process body, keeps each case's peak memory separate
+        """
+        config = json.loads(json.dumps(self.base_config))
+        config['aws_frederick'] = self.fixture(subsystem, size)
+
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+        view = AWSFrederickBenchView(key_file, subsystem)
+        try:
+            AWSFrederickEnv(view=view, config_file_override=config)
+        except Exception:
+            # Recorded rather than raised, a case hitting a CloudFormation
+            # limit is a result in itself
+            queue.put({'error': traceback.format_exc().strip().splitlines()[-1]})
+            return
+
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put(dict(
+            (name, dict(result, peak_rss_kb=peak_rss_kb))
+            for name, result in view.results.items()
+        ))
+
+    def run(self, subsystems, sizes):
+        """
+        Returns {'<subsystem>-<size>': {child template: metrics}}
+        """
+        for subsystem in subsystems:
+            for size in sizes:
+                self.fixture(subsystem, size)
+
+        work_dir = tempfile.mkdtemp(prefix='aws-frederick-bench')
+        key_file = os.path.join(work_dir, 'keys.yaml')
+        with open(key_file, 'w') as f:
+            f.write(yaml.safe_dump(self.secrets, default_flow_style=False))
+
+        results = {}
+        cwd = os.getcwd()
+        try:
+            # environmentbase writes ami_cache.json and templates/ relative to
+            # the working directory
+            shutil.copy(os.path.join(cwd, 'ami_cache.json'), work_dir)
+            os.chdir(work_dir)
+
+            for subsystem in subsystems:
+                for size in sizes:
+                    case = '%s-%d' % (subsystem, size)
+                    queue = Queue()
+                    process = Process(target=self.run_case, args=(subsystem, size, key_file, queue))
+                    process.start()
+                    results[case] = queue.get()
+                    process.join()
+                    self.print_case(case, results[case])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir)
+
+        return results
+
+    @staticmethod
+    def print_case(case, case_results):
+        if 'error' in case_results:
+            print("%-24s FAILED %s" % (case, case_results['error']))
+            return
+
+        for name, metrics in sorted(case_results.items()):
+            print("%-24s %-32s %10.3fs %10dKB %10d bytes %6d resources" % (
+                case,
+                name,
+                metrics['build_seconds'],
+                metrics['peak_rss_kb'],
+                metrics['template_bytes'],
+                metrics['resources']))
+
+    def regressions(self, results, baseline):
+        """
+        Returns (case, template, metric, baseline, current) for every metric
+        that grew by more than its floor and the tolerance, and for every case
+        that fails but did not fail in the baseline
+        """
+        found = []
+        for case, case_results in sorted(results.items()):
+            expected_results = baseline.get(case, {})
+            if 'error' in case_results:
+                if case in baseline and 'error' not in expected_results:
+                    found.append((case, '-', 'error', None, case_results['error']))
+                continue
+            if 'error' in expected_results:
+                continue
+
+            for name, metrics in sorted(case_results.items()):
+                expected = expected_results.get(name)
+                if expected is None:
+                    continue
+
+                for metric, floor in sorted(self.METRIC_FLOORS.items()):
+                    current = metrics[metric]
+                    allowed = expected[metric] * (1 + self.tolerance / 100.0)
+                    if current > allowed and current - expected[metric] > floor:
+                        found.append((case, name, metric, expected[metric], current))
+        return found
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    with open(args['--config-file']) as f:
+        base_config = yaml.safe_load(f)
+
+    bench = AWSFrederickBench(base_config, tolerance=int(args['--tolerance']))
+    results = bench.run(
+        args['--subsystems'].split(','),
+        [int(size) for size in args['--sizes'].split(',')]
+    )
+
+    if args['--update-baseline']:
+        with open(args['--baseline'], 'w') as f:
+            f.write(json.dumps(results, indent=4, sort_keys=True, separators=(',', ': ')))
+        print("\nWrote baseline %s" % args['--baseline'])
+        sys.exit(0)
+
+    if not os.path.isfile(args['--baseline']):
+        print("\nNo baseline at %s, run with --update-baseline" % args['--baseline'])
+        sys.exit(0)
+
+    with open(args['--baseline']) as f:
+        baseline = json.load(f)
+
+    regressions = bench.regressions(results, baseline)
+    if not regressions:
+        print("\nNo regressions against %s" % args['--baseline'])
+        sys.exit(0)
+
+    print("\nRegressions against %s:" % args['--baseline'])
+    for case, name, metric, expected, current in regressions:
+        print("  %s %s %s: %s -> %s" % (case, name, metric, expected, current))
+    sys.exit(1)
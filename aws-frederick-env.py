@@ -2,35 +2,86 @@
 '''
 Usage:
     aws-frederick-env.py (create|deploy) [--config-file <FILE_LOCATION>] [--debug]
-    [--template-file=<TEMPLATE_FILE>]
+    [--offline] [--key-file <KEY_FILE>] [--parallel] [--change-set]
+    [--profile] [--template-file=<TEMPLATE_FILE>]
 
 Options:
   -h --help                            Show this screen.
   -v --version                         Show version.
   --debug                              Prints parent template to console out.
   --config-file <CONFIG_FILE>          Name of json configuration file.
+  --offline                            Create templates without calling AWS,
+                                       secrets are resolved from --key-file
+                                       and nothing is uploaded to S3.
+  --key-file <KEY_FILE>                Yaml file mapping encrypted config
+                                       values to plaintext for --offline.
+  --parallel                           Build the child templates concurrently.
+  --change-set                         Deploy through a change set, printing
+                                       a per-resource plan and skipping the
+                                       update when nothing changed.
+  --profile                            Print per phase and per template
+                                       timings and write them as json to the
+                                       stack outputs directory.
   --template-file=<TEMPLATE_FILE>      Name of template to be either generated
                                        or deployed.
 '''
 
 from environmentbase.networkbase import NetworkBase
+from environmentbase.environmentbase import ValidationError
+from environmentbase.cli import CLI
+from environmentbase.template import Template
+from environmentbase import utility
+from aws_frederick_common import AWSFrederickCommonTemplate, AWSFrederickSecretCache
+from aws_frederick_common import AWSFrederickKmsKeyProvider, AWSFrederickLocalKeyProvider
+from aws_frederick_upload import AWSFrederickTemplateCache
+from aws_frederick_changeset import AWSFrederickStackPlan, AWSFrederickChangeSet
 from aws_frederick_ec2 import AWSFrederickEC2Template
 from aws_frederick_ecs import AWSFrederickECSTemplate
 from aws_frederick_rds import AWSFrederickRdsTemplate
+from aws_frederick_elasticache import AWSFrederickElastiCacheTemplate
 from aws_frederick_bucket import AWSFrederickBucketTemplate
 from aws_frederick_ad import AWSFrederickADTemplate
+from multiprocessing.pool import ThreadPool
 import troposphere.ec2 as ec2
+import os.path
+import time
 import boto.vpc
 import boto
 
 
+class AWSFrederickCLI(CLI):
+    """
+    Adds the AWS Frederick command line options on top of environmentbase's
+    """
+
+    def update_config(self, config):
+        super(AWSFrederickCLI, self).update_config(config)
+
+        if self.args.get('--offline'):
+            if self.args.get('deploy'):
+                raise ValidationError('--offline can only be used with create')
+
+            config['global']['offline'] = True
+            config['global']['key_file'] = self.args.get('--key-file')
+            config['template']['s3_upload'] = False
+
+        if self.args.get('--parallel'):
+            config['global']['parallel_build'] = True
+
+        if self.args.get('--change-set'):
+            config['global']['change_set_deploy'] = True
+
+        if self.args.get('--profile'):
+            config['global']['profile'] = True
+
+
 class AWSFrederickEnv(NetworkBase):
     """
     Coordinates AWS Frederick stack actions (create and deploy)
     """
 
-    def __init__(self):
-        super(AWSFrederickEnv, self).__init__()
+    def __init__(self, view=None, config_file_override=None):
+        super(AWSFrederickEnv, self).__init__(view=view, config_file_override=config_file_override)
 
     # When no config.json file exists a new one is created using the
     # 'factory default' file.  This function augments the factory default
@@ -50,6 +101,200 @@ class AWSFrederickEnv(NetworkBase):
     def get_config_schema_hook():
         return AWSFrederickCommonTemplate.CONFIG_SCHEMA
 
+    def load_config(self, view=None, config=None):
+        super(AWSFrederickEnv, self).load_config(view=view, config=config)
+
+        if self.globals.get('profile'):
+            AWSFrederickCommonTemplate.profiler.enable()
+
+    def create_action(self):
+        self.profiled_action('create', super(AWSFrederickEnv, self).create_action)
+
+    def deploy_action(self):
+        self.profiled_action('deploy', super(AWSFrederickEnv, self).deploy_action)
+
+    # With global.profile the timings collected while the action ran are
+    # printed and written to <stack_outputs_directory>/profile-<action>-<time>.json
+    def profiled_action(self, action, run):
+        profiler = AWSFrederickCommonTemplate.profiler
+        with profiler.phase(action):
+            run()
+
+        if not profiler.enabled:
+            return
+
+        profiler.print_report()
+
+        stack_outputs_dir = self.stack_outputs_directory()
+        if not os.path.isdir(stack_outputs_dir):
+            os.mkdir(stack_outputs_dir)
+
+        report_path = os.path.join(
+            stack_outputs_dir,
+            'profile-%s-%s.json' % (action, time.strftime('%Y%m%d%H%M%S', time.gmtime())))
+        profiler.write_json(report_path, action)
+        print("Profile:\t{}\n".format(report_path))
+
+    # With template.upload_cache (on by default) child templates are stored
+    # under content addressed keys, so an unchanged child keeps its existing
+    # S3 url and only templates whose content changed are uploaded
+    def upload_cache_enabled(self):
+        return self.template_args.get('upload_cache', True)
+
+    def initialize_template(self):
+        super(AWSFrederickEnv, self).initialize_template()
+
+        if self.upload_cache_enabled():
+            # environmentbase asks the parent for each child's url once the
+            # child's build is complete
+            self.template.get_template_s3_url = self.get_content_addressed_url
+
+    def get_content_addressed_url(self, child_template):
+        child_template.resource_path = AWSFrederickTemplateCache.content_path(
+            Template.s3_path_prefix,
+            child_template.name,
+            child_template.to_json()
+        )
+        return Template.get_template_s3_url(self.template, child_template)
+
+    # Build the AWS Frederick child templates before environmentbase serializes
+    # them. With global.parallel_build each child's build_hook and json
+    # rendering runs on its own thread; the parent still wires the stacks in
+    # the order they were added so the output matches a serial build.
+    def serialize_templates(self):
+        self.build_child_templates()
+
+        with AWSFrederickCommonTemplate.profiler.phase('serialize'):
+            self.serialize_built_templates()
+
+        self.write_lambda_packages()
+
+    def serialize_built_templates(self):
+        s3_upload = self.template_args.get('s3_upload', True)
+        if not (s3_upload and self.upload_cache_enabled()):
+            return super(AWSFrederickEnv, self).serialize_templates()
+
+        self._ensure_template_dir_exists()
+        self.serialize_templates_helper(
+            template=self.template,
+            s3_client=None,
+            s3_upload=False)
+        self.upload_changed_templates()
+
+    def get_template_cache(self):
+        return AWSFrederickTemplateCache(
+            utility.get_boto_client(self.config, 's3'),
+            Template.template_bucket_default,
+            os.path.join(self.s3_prefix(), 'manifest.json'),
+            acl=Template.upload_acl
+        )
+
+    def upload_changed_templates(self):
+        template_cache = self.get_template_cache()
+
+        templates = [self.template]
+        while templates:
+            template = templates.pop(0)
+            templates.extend(child for child, merge, _, _, _ in template._child_templates if not merge)
+
+            with open(template.resource_path) as template_file, \
+                    AWSFrederickCommonTemplate.profiler.phase('upload', template.name):
+                uploaded = template_cache.upload(template.resource_path, template_file.read())
+
+            print("{}\t{}".format(
+                'S3:' if uploaded else 'S3 (unchanged):',
+                utility.get_template_s3_url(Template.template_bucket_default, template.resource_path)))
+
+        template_cache.save()
+
+    # Lambda packages referenced by the templates are saved next to them and,
+    # like the templates, uploaded to the template bucket unless the content
+    # is already stored under their key
+    def write_lambda_packages(self):
+        packages = AWSFrederickCommonTemplate.lambda_packages
+        if not packages:
+            return
+
+        template_cache = None
+        if self.template_args.get('s3_upload', True):
+            template_cache = self.get_template_cache()
+
+        for resource_path, package in sorted(packages.items()):
+            package_dir = os.path.dirname(resource_path)
+            if not os.path.isdir(package_dir):
+                os.makedirs(package_dir)
+            with open(resource_path, 'wb') as package_file:
+                package_file.write(package.body)
+
+            if template_cache is not None:
+                with AWSFrederickCommonTemplate.profiler.phase('upload', package.name):
+                    uploaded = template_cache.upload(resource_path, package.body, content_hash=package.content_hash)
+                print("{}\t{}".format(
+                    'S3:' if uploaded else 'S3 (unchanged):',
+                    utility.get_template_s3_url(Template.template_bucket_default, resource_path)))
+
+            print("Local:\t{}\n".format(resource_path))
+
+        if template_cache is not None:
+            template_cache.save()
+
+    def build_child_templates(self):
+        children = [
+            child for child, merge, _, _, _ in self.template._child_templates
+            if not merge and isinstance(child, AWSFrederickCommonTemplate)
+        ]
+
+        if self.globals.get('parallel_build') and len(children) > 1:
+            pool = ThreadPool(len(children))
+            try:
+                pool.map(lambda child: child.prebuild(self.template), children)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for child in children:
+                child.prebuild(self.template)
+
+    # With global.change_set_deploy the rendered templates are diffed against
+    # the deployed stack first. Nothing is submitted when there is no diff,
+    # otherwise the update goes through a change set on the root stack, where
+    # nested stacks with an unchanged TemplateURL and parameters are left alone.
+    def _ensure_stack_is_deployed(self, stack_name='UnnamedStack', sns_topic=None, stack_params=[]):
+        with AWSFrederickCommonTemplate.profiler.phase('stack_update', stack_name):
+            return self.deploy_stack(stack_name, sns_topic, stack_params)
+
+    def deploy_stack(self, stack_name, sns_topic, stack_params):
+        cfn_client = utility.get_boto_client(self.config, 'cloudformation')
+
+        if not self.globals.get('change_set_deploy') or \
+                not AWSFrederickChangeSet.stack_exists(cfn_client, stack_name):
+            return super(AWSFrederickEnv, self)._ensure_stack_is_deployed(
+                stack_name=stack_name,
+                sns_topic=sns_topic,
+                stack_params=stack_params)
+
+        plan = AWSFrederickStackPlan(cfn_client, stack_name)
+        plan.build(self._root_template_path(), stack_params)
+        plan.print_plan()
+
+        if not plan.changes:
+            print("\nNo changes for %s, skipping update\n" % stack_name)
+            return False
+
+        notification_arns = [sns_topic.arn] if sns_topic else []
+        change_set = AWSFrederickChangeSet(cfn_client, stack_name)
+        result = change_set.create(self._root_template_url(), stack_params, notification_arns)
+
+        if result['Status'] == 'FAILED':
+            print("Change set for %s failed: %s\n" % (stack_name, result.get('StatusReason')))
+            change_set.delete()
+            return False
+
+        AWSFrederickChangeSet.print_changes(result)
+        change_set.execute()
+        print("\nSuccessfully executed change set %s for %s\n" % (change_set.change_set_name, stack_name))
+        return True
+
     # Override the default create action to construct an AWSFrederick stack
     def create_hook(self):
         super(AWSFrederickEnv, self).create_hook()
@@ -63,6 +308,16 @@ class AWSFrederickEnv(NetworkBase):
         aws_frederick_config = self.config.get('aws_frederick')
         env_name = self.globals.get('environment_name', 'aws-frederick-env')
 
+        # Decrypt every KMS secret in one concurrent batch before the child
+        # templates are built
+        if self.globals.get('offline'):
+            key_provider = AWSFrederickLocalKeyProvider(self.globals.get('key_file'))
+        else:
+            key_provider = AWSFrederickKmsKeyProvider(region)
+
+        AWSFrederickCommonTemplate.secrets = AWSFrederickSecretCache(key_provider)
+        AWSFrederickCommonTemplate.secrets.prefetch(aws_frederick_config)
+
         security_group_rules = [
             ec2.SecurityGroupRule(
                 FromPort='0',
@@ -108,6 +363,16 @@ class AWSFrederickEnv(NetworkBase):
 
             self.add_child_template(aws_frederick_rds_template)
 
+        if self.config.get('aws_frederick').get('elasticache'):
+            aws_frederick_elasticache_template = AWSFrederickElastiCacheTemplate(
+                env_name,
+                region,
+                cidr_range,
+                aws_frederick_config
+            )
+
+            self.add_child_template(aws_frederick_elasticache_template)
+
         if self.config.get('aws_frederick').get('ec2'):
             aws_frederick_ec2_template = AWSFrederickEC2Template(
                 env_name,
@@ -139,4 +404,4 @@ class AWSFrederickEnv(NetworkBase):
             self.add_child_template(aws_frederick_bucket_template)
 
 if __name__ == '__main__':
-    AWSFrederickEnv()
+    AWSFrederickEnv(view=AWSFrederickCLI(doc=__doc__))
@@ -4,8 +4,6 @@ from troposphere import Parameter, Ref, Template
 from troposphere import directoryservice
 from troposphere.ec2 import DHCPOptions
 from troposphere.ec2 import VPCDHCPOptionsAssociation
-import boto3
-import base64
 
 
 class AWSFrederickADTemplate(AWSFrederickCommonTemplate):
@@ -30,9 +28,7 @@ class AWSFrederickADTemplate(AWSFrederickCommonTemplate):
 
         if ads is not None:
             for ad in ads:
-                client = boto3.client('kms')
-                response = client.decrypt(CiphertextBlob=base64.b64decode(ad.get('password')))
-                password = response['Plaintext']
+                password = self.get_secret(ad.get('password'))
                 # password = ad.get('password')
                 print('AD Password is: %s' % password)
                 self.add_simple_ads(
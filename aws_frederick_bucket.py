@@ -1,12 +1,8 @@
 from aws_frederick_common import AWSFrederickCommonTemplate
 from troposphere import GetAtt, Join, Output
 from troposphere import Parameter, Ref, Template
-from troposphere.cloudfront import Distribution, DistributionConfig
-from troposphere.cloudfront import Origin, DefaultCacheBehavior
-from troposphere.cloudfront import ForwardedValues
+from troposphere.cloudfront import Origin
 from troposphere.cloudfront import S3Origin
-from troposphere.cloudfront import ViewerCertificate
-from troposphere.route53 import AliasTarget, RecordSetGroup, RecordSet
 
 
 class AWSFrederickBucketTemplate(AWSFrederickCommonTemplate):
@@ -14,6 +10,22 @@ class AWSFrederickBucketTemplate(AWSFrederickCommonTemplate):
     Enhances basic template by providing AWS Frederick bucket resources
     """
 
+    # buckets[].cloudfront settings used when the config leaves them out or
+    # is just true. TTLs are in seconds, http_version is http1.1, http2,
+    # http3 or http2and3, and each entry of behaviors takes a path plus any
+    # of compress, query_string and the ttls
+    DEFAULT_CLOUDFRONT = {
+        'acm_cert': 'arn:aws:acm:us-east-1:422548007577:certificate/4d2f2450-7616-4daa-b7ed-c1fd2d53df90',
+        'default_root_object': 'index.html',
+        'price_class': 'PriceClass_All',
+        'http_version': 'http2',
+        'compress': True,
+        'query_string': False,
+        'min_ttl': 0,
+        'default_ttl': 86400,
+        'max_ttl': 31536000
+    }
+
     def __init__(self, env_name, region, cidr_range, aws_frederick_config):
         super(AWSFrederickBucketTemplate, self).__init__(env_name + 'Bucket')
 
@@ -35,44 +47,95 @@ class AWSFrederickBucketTemplate(AWSFrederickCommonTemplate):
                     bucket.get('name'),
                     bucket.get('access_control'),
                     bucket.get('static_site'),
-                    bucket.get('route53'),
+                    # A distribution in front of the bucket takes over its record
+                    bucket.get('route53') and not bucket.get('cloudfront'),
                     public_hosted_zone_name,
+                    transfer_acceleration=bucket.get('transfer_acceleration', False),
+                    lifecycle=bucket.get('lifecycle'),
+                    intelligent_tiering=bucket.get('intelligent_tiering'),
+                    request_metrics=bucket.get('request_metrics')
                 )
                 if bucket.get('cloudfront'):
-                    cloudfront = self.add_resource(Distribution(bucket.get('name').replace('.',''),
-                        DistributionConfig=DistributionConfig(
-                            Aliases=[bucket.get('name')],
-                            DefaultRootObject='index.html',
-                            Origins=[Origin(Id="Origin 1",
-                            DomainName=bucket.get('name') + '.s3.amazonaws.com',
-                            S3OriginConfig=S3Origin())],
-                            DefaultCacheBehavior=DefaultCacheBehavior(
-                                TargetOriginId="Origin 1",
-                                ForwardedValues=ForwardedValues(
-                                    QueryString=False),
-                                    ViewerProtocolPolicy="redirect-to-https"),
-                            Enabled=True,
-                            HttpVersion='http2',
-                            ViewerCertificate=ViewerCertificate(
-                                AcmCertificateArn='arn:aws:acm:us-east-1:422548007577:certificate/4d2f2450-7616-4daa-b7ed-c1fd2d53df90',
-                                SslSupportMethod='sni-only'
-                            ))))
+                    self.add_bucket_cloudfront(
+                        bucket.get('name'),
+                        bucket.get('cloudfront'),
+                        bucket.get('route53'),
+                        public_hosted_zone_name
+                    )
                     # todo: ipv6 - cloudformation not supported
-                    # todo: ssl cert via acm
-                    # todo: dns alias for cloudfront
-                    #"Z2FDTNDATAQYW2"
-                #     self.add_resource(RecordSetGroup(
-                #         "cloudfrontroute53",
-                #         HostedZoneName=public_hosted_zone_name,
-                #         RecordSets=[
-                #             RecordSet(
-                #                 Name=bucket.get('name'),
-                #                 Type="A",
-                #                 AliasTarget=AliasTarget(
-                #                     "Z2FDTNDATAQYW2",
-                #                     Ref(cloudfront)
-                #                 ),
-                #             ),
-                #         ],
-                #     )
-                # )
+
+    def add_bucket_cloudfront(self, bucket_name, cloudfront, route53, public_hosted_zone):
+        """
+        Puts a CloudFront distribution in front of a bucket, with route53 its
+        aliases inside the public hosted zone are pointed at it
+        @param bucket_name [string] name of the bucket, also its default alias
+        @param cloudfront [dict|bool] overrides of DEFAULT_CLOUDFRONT, true
+        for the defaults
+        @param route53 [boolean] create route53 entries for the aliases?
+        @param public_hosted_zone [string] Name of the public hosted zone
+        """
+        cloudfront = dict(self.DEFAULT_CLOUDFRONT, **(cloudfront if isinstance(cloudfront, dict) else {}))
+        origin_id = 'Origin 1'
+
+        origin = Origin(
+            Id=origin_id,
+            DomainName=bucket_name + '.s3.amazonaws.com',
+            S3OriginConfig=S3Origin()
+        )
+
+        if cloudfront.get('origin_shield_region'):
+            # troposphere 2.2.1 predates origin shield
+            origin.properties['OriginShield'] = {
+                'Enabled': True,
+                'OriginShieldRegion': cloudfront['origin_shield_region']
+            }
+
+        default_behavior = self.get_bucket_cache_behavior(origin_id, cloudfront)
+        behaviors = [
+            self.get_bucket_cache_behavior(origin_id, dict(cloudfront, **behavior), behavior['path'])
+            for behavior in cloudfront.get('behaviors', [])
+        ]
+
+        aliases = cloudfront.get('aliases', [bucket_name])
+        distribution = self.add_cloudfront_distribution(
+            bucket_name,
+            aliases,
+            origin,
+            default_behavior,
+            behaviors,
+            cloudfront['acm_cert'],
+            price_class=cloudfront['price_class'],
+            http_version=cloudfront['http_version'],
+            default_root_object=cloudfront['default_root_object']
+        )
+
+        if not route53:
+            return distribution
+
+        # Same logical id as the S3 website alias add_bucket would create, so
+        # putting a distribution in front of a bucket updates its record
+        zone_name = (public_hosted_zone or '').rstrip('.').lower()
+        for alias in aliases:
+            alias = alias.rstrip('.').lower()
+            if zone_name and (alias == zone_name or alias.endswith('.' + zone_name)):
+                self.add_cloudfront_dns_alias(distribution, alias + '.', public_hosted_zone)
+
+        return distribution
+
+    def get_bucket_cache_behavior(self, origin_id, settings, path_pattern=None):
+        """
+        Returns the cache behavior for a path pattern, or the default
+        behavior, from the distribution or behavior settings
+        @param origin_id [string] Id of the bucket origin
+        @param settings [dict] compress, query_string and ttl settings
+        @param path_pattern [string] paths the behavior applies to
+        """
+        return self.get_cloudfront_cache_behavior(
+            origin_id,
+            path_pattern=path_pattern,
+            compress=settings['compress'],
+            min_ttl=settings['min_ttl'],
+            default_ttl=settings['default_ttl'],
+            max_ttl=settings['max_ttl'],
+            query_string=settings['query_string']
+        )
@@ -0,0 +1,205 @@
+from aws_frederick_upload import AWSFrederickTemplateCache
+from botocore.exceptions import ClientError
+import json
+import time
+
+
+class AWSFrederickStackPlan(object):
+    """
+    Compares the locally rendered templates against the deployed stack and
+    its nested stacks, resource by resource
+    """
+
+    STACK_TYPE = 'AWS::CloudFormation::Stack'
+
+    def __init__(self, cfn_client, stack_name):
+        """
+        @param cfn_client [CloudFormation.Client] boto3 cloudformation client
+        @param stack_name [string] name of the deployed root stack
+        """
+        self.cfn_client = cfn_client
+        self.stack_name = stack_name
+        self.changes = []
+
+    @staticmethod
+    def load_local_template(resource_path):
+        with open(resource_path) as template_file:
+            return json.load(template_file)
+
+    @staticmethod
+    def normalize(template):
+        """
+        Strips the outputs environmentbase regenerates on every build so only
+        real changes are compared
+        """
+        template = json.loads(json.dumps(template))
+        outputs = template.get('Outputs', {})
+        for output_key in AWSFrederickTemplateCache.VOLATILE_OUTPUTS:
+            outputs.pop(output_key, None)
+        return template
+
+    @staticmethod
+    def template_resource_path(template_url):
+        """
+        Returns the S3 resource path from a nested stack TemplateURL, which
+        environmentbase renders as a Fn::Join ending in the path
+        """
+        if isinstance(template_url, dict) and 'Fn::Join' in template_url:
+            return template_url['Fn::Join'][1][-1]
+        return template_url.split('.amazonaws.com/', 1)[-1]
+
+    def deployed_template(self, stack_id):
+        body = self.cfn_client.get_template(StackName=stack_id)['TemplateBody']
+        if not isinstance(body, dict):
+            body = json.loads(body)
+        return body
+
+    def deployed_parameters(self):
+        stack = self.cfn_client.describe_stacks(StackName=self.stack_name)['Stacks'][0]
+        return dict((p['ParameterKey'], p['ParameterValue']) for p in stack.get('Parameters', []))
+
+    def nested_stack_ids(self):
+        resources = self.cfn_client.describe_stack_resources(StackName=self.stack_name)['StackResources']
+        return dict(
+            (r['LogicalResourceId'], r['PhysicalResourceId'])
+            for r in resources if r['ResourceType'] == self.STACK_TYPE
+        )
+
+    def diff_templates(self, stack_label, deployed, local):
+        """
+        Records added (+), removed (-) and modified (~) resources between two
+        templates, plus a single entry for changes outside of Resources
+        """
+        deployed = self.normalize(deployed)
+        local = self.normalize(local)
+        deployed_resources = deployed.pop('Resources', {})
+        local_resources = local.pop('Resources', {})
+
+        for name in sorted(set(deployed_resources) | set(local_resources)):
+            if name not in deployed_resources:
+                action = '+'
+            elif name not in local_resources:
+                action = '-'
+            elif deployed_resources[name] != local_resources[name]:
+                action = '~'
+            else:
+                continue
+            resource_type = (local_resources.get(name) or deployed_resources.get(name)).get('Type')
+            self.changes.append((stack_label, action, name, resource_type))
+
+        if deployed != local:
+            self.changes.append((stack_label, '~', '(parameters, mappings or outputs)', None))
+
+    def build(self, root_resource_path, stack_params):
+        """
+        Diffs the local root template and every changed nested stack against
+        what is deployed. Returns the list of (stack, action, resource, type)
+        changes, empty when the deploy would be a no-op
+        @param root_resource_path [string] local path of the rendered root template
+        @param stack_params [list] ParameterKey/ParameterValue deploy bindings
+        """
+        self.changes = []
+        local_root = self.load_local_template(root_resource_path)
+        deployed_root = self.deployed_template(self.stack_name)
+
+        local_params = dict((p['ParameterKey'], p['ParameterValue']) for p in stack_params)
+        deployed_params = self.deployed_parameters()
+        for key in sorted(local_params):
+            if deployed_params.get(key) != local_params[key]:
+                self.changes.append((self.stack_name, '~', 'parameter ' + key, None))
+
+        self.diff_templates(self.stack_name, deployed_root, local_root)
+
+        # A nested stack whose TemplateURL changed points at new content, diff
+        # it against the template the nested stack is running
+        nested_ids = self.nested_stack_ids()
+        deployed_resources = deployed_root.get('Resources', {})
+        for name, resource in sorted(local_root.get('Resources', {}).items()):
+            if resource.get('Type') != self.STACK_TYPE or name not in nested_ids:
+                continue
+
+            local_url = resource['Properties']['TemplateURL']
+            deployed_url = deployed_resources.get(name, {}).get('Properties', {}).get('TemplateURL')
+            if local_url == deployed_url:
+                continue
+
+            self.diff_templates(
+                name,
+                self.deployed_template(nested_ids[name]),
+                self.load_local_template(self.template_resource_path(local_url))
+            )
+
+        return self.changes
+
+    def print_plan(self):
+        if not self.changes:
+            print("Plan for %s: no changes" % self.stack_name)
+            return
+
+        print("Plan for %s:" % self.stack_name)
+        for stack_label, action, name, resource_type in self.changes:
+            print("  %s %s/%s%s" % (action, stack_label, name, ' (%s)' % resource_type if resource_type else ''))
+        print('')
+
+
+class AWSFrederickChangeSet(object):
+    """
+    Submits a stack update as a change set so it can be inspected before it
+    runs and dropped when CloudFormation finds nothing to change
+    """
+
+    POLL_SECONDS = 2
+
+    def __init__(self, cfn_client, stack_name):
+        self.cfn_client = cfn_client
+        self.stack_name = stack_name
+        self.change_set_name = '%s-%d' % (stack_name, int(time.time()))
+
+    def create(self, template_url, stack_params, notification_arns):
+        self.cfn_client.create_change_set(
+            StackName=self.stack_name,
+            ChangeSetName=self.change_set_name,
+            TemplateURL=template_url,
+            Parameters=stack_params,
+            NotificationARNs=notification_arns,
+            Capabilities=['CAPABILITY_IAM'],
+            ChangeSetType='UPDATE')
+
+        while True:
+            change_set = self.cfn_client.describe_change_set(
+                StackName=self.stack_name,
+                ChangeSetName=self.change_set_name)
+            if change_set['Status'] in ('CREATE_COMPLETE', 'FAILED'):
+                return change_set
+            time.sleep(self.POLL_SECONDS)
+
+    def execute(self):
+        self.cfn_client.execute_change_set(
+            StackName=self.stack_name,
+            ChangeSetName=self.change_set_name)
+
+    def delete(self):
+        self.cfn_client.delete_change_set(
+            StackName=self.stack_name,
+            ChangeSetName=self.change_set_name)
+
+    @staticmethod
+    def print_changes(change_set):
+        for change in change_set.get('Changes', []):
+            resource = change.get('ResourceChange', {})
+            print("  %s %s (%s) replacement: %s" % (
+                resource.get('Action'),
+                resource.get('LogicalResourceId'),
+                resource.get('ResourceType'),
+                resource.get('Replacement', 'N/A')))
+        print('')
+
+    @staticmethod
+    def stack_exists(cfn_client, stack_name):
+        try:
+            cfn_client.describe_stacks(StackName=stack_name)
+        except ClientError as e:
+            if 'does not exist' in str(e):
+                return False
+            raise
+        return True
@@ -1,4 +1,5 @@
 import troposphere.autoscaling as autoscaling
+import troposphere.applicationautoscaling as applicationautoscaling
 import troposphere.sqs as sqs
 import troposphere.ec2 as ec2
 import troposphere.iam as iam
@@ -7,17 +8,163 @@ import troposphere.route53 as route53
 import troposphere.kms as kms
 from troposphere import elasticache
 import troposphere.cloudwatch as cloudwatch
+import troposphere.cloudfront as cloudfront
+import troposphere.awslambda as awslambda
+import troposphere.servicediscovery as servicediscovery
 from troposphere.rds import DBInstance, DBSubnetGroup, Tags
-from troposphere import Ref, GetAtt, Join
+from troposphere import Ref, GetAtt, Join, Select, GetAZs
 from environmentbase.template import Template
+from aws_frederick_profile import AWSFrederickProfiler
+from aws_frederick_upload import AWSFrederickLambdaPackage
 import awacs.iam
 from troposphere.ecr import Repository
 from awacs.aws import Allow, Policy, AWSPrincipal, Statement
 import awacs.ecr as ecr
 import troposphere.ecs as ecs
+from multiprocessing.pool import ThreadPool
+from botocore.config import Config
+import threading
+import hashlib
+import json
+import os
+import base64
+import boto3
+import yaml
 import sys
 
 
+class AWSFrederickKmsKeyProvider(object):
+    """
+    Key provider that decrypts config values with AWS KMS
+    """
+
+    def __init__(self, region=None, max_connections=8):
+        self.region = region
+        self.max_connections = max_connections
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        """
+        Single KMS client shared by every decrypt call, sized so concurrent
+        callers never wait on a connection
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client(
+                    'kms',
+                    region_name=self.region,
+                    config=Config(max_pool_connections=self.max_connections)
+                )
+        return self._client
+
+    def decrypt(self, ciphertext):
+        response = self.client().decrypt(CiphertextBlob=base64.b64decode(ciphertext))
+        return response['Plaintext']
+
+
+class AWSFrederickLocalKeyProvider(object):
+    """
+    Offline stand-in for KMS that resolves config values from a local key
+    file instead of calling AWS
+    """
+
+    def __init__(self, key_file=None):
+        """
+        @param key_file [string] yaml/json file mapping base64 ciphertexts to
+        their plaintext values
+        """
+        self.keys = {}
+        if key_file:
+            with open(key_file) as f:
+                self.keys = yaml.safe_load(f) or {}
+
+    def decrypt(self, ciphertext):
+        if ciphertext in self.keys:
+            return str(self.keys[ciphertext])
+
+        print "WARNING: No local key for secret, using offline placeholder"
+        return 'offline-' + hashlib.sha1(ciphertext).hexdigest()[:16]
+
+
+class AWSFrederickSecretCache(object):
+    """
+    Build scoped cache of decrypted config values shared by every child
+    template
+    """
+
+    # (config section, key) pairs holding KMS encrypted values
+    ENCRYPTED_KEYS = [
+        ('rds', 'password'),
+        ('simple_ads', 'password')
+    ]
+
+    def __init__(self, key_provider=None, max_workers=8):
+        """
+        @param key_provider [object] provider exposing decrypt(ciphertext),
+        defaults to AWS KMS
+        @param max_workers [int] number of concurrent decrypt calls
+        """
+        self.key_provider = key_provider or AWSFrederickKmsKeyProvider(max_connections=max_workers)
+        self.max_workers = max_workers
+        self._plaintext = {}
+        self._lock = threading.Lock()
+
+    def collect(self, aws_frederick_config):
+        """
+        Helper returns the de-duplicated encrypted values in the aws_frederick
+        config section
+        @param aws_frederick_config [dict] aws_frederick section of the config
+        """
+        ciphertexts = set()
+        for section, key in self.ENCRYPTED_KEYS:
+            for entry in aws_frederick_config.get(section) or []:
+                if entry.get(key):
+                    ciphertexts.add(entry.get(key))
+        return sorted(ciphertexts)
+
+    def prefetch(self, aws_frederick_config):
+        """
+        Decrypts every encrypted value in the config concurrently so child
+        templates only ever read from the cache
+        @param aws_frederick_config [dict] aws_frederick section of the config
+        """
+        pending = [c for c in self.collect(aws_frederick_config) if c not in self._plaintext]
+        if not pending:
+            return
+
+        print "Decrypting %d secrets" % len(pending)
+        with AWSFrederickCommonTemplate.profiler.phase('secrets'):
+            pool = ThreadPool(min(len(pending), self.max_workers))
+            try:
+                plaintexts = pool.map(self.provider_decrypt, pending)
+            finally:
+                pool.close()
+                pool.join()
+
+        with self._lock:
+            self._plaintext.update(zip(pending, plaintexts))
+
+    def decrypt(self, ciphertext):
+        """
+        Returns the plaintext for a base64 encoded ciphertext, calling the key
+        provider only if the value was not prefetched
+        @param ciphertext [string] base64 encoded KMS ciphertext blob
+        """
+        with self._lock:
+            if ciphertext in self._plaintext:
+                return self._plaintext[ciphertext]
+
+        plaintext = self.provider_decrypt(ciphertext)
+        with self._lock:
+            self._plaintext[ciphertext] = plaintext
+        return plaintext
+
+    def provider_decrypt(self, ciphertext):
+        with AWSFrederickCommonTemplate.profiler.phase('decrypt'):
+            return self.key_provider.decrypt(ciphertext)
+
+
 class AWSFrederickCommonTemplate(Template):
     """
     Enhances basic template by providing AWS Frederick common resources
@@ -37,12 +184,80 @@ class AWSFrederickCommonTemplate(Template):
         }
     }
 
+    # IAM policies by type, parsed lazily from POLICY_FILE by load_policy_map
+    POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'policies.json')
     POLICY_MAP = {}
+    _policy_lock = threading.Lock()
+
+    # Route53 hosted zone id of every CloudFront distribution, used as the
+    # alias target zone
+    CLOUDFRONT_HOSTED_ZONE_ID = 'Z2FDTNDATAQYW2'
+
+    # Storage classes a lifecycle rule can transition objects to, in the only
+    # order S3 accepts them, with the minimum age in days S3 allows
+    LIFECYCLE_STORAGE_CLASSES = [
+        ('STANDARD_IA', 30),
+        ('INTELLIGENT_TIERING', 0),
+        ('ONEZONE_IA', 30),
+        ('GLACIER_IR', 0),
+        ('GLACIER', 0),
+        ('DEEP_ARCHIVE', 0)
+    ]
+
+    # KMS secret cache shared across child templates, replaced per build by
+    # the controller
+    secrets = AWSFrederickSecretCache()
+
+    # Timing of the build phases, enabled by the controller with --profile
+    profiler = AWSFrederickProfiler()
+
+    # Lambda source directories live under LAMBDA_DIR. Packages referenced by
+    # the templates are collected here by S3 resource path and written and
+    # uploaded by the controller along with the templates
+    LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda')
+    lambda_packages = {}
+    _lambda_lock = threading.Lock()
 
     # Collect all the values we need to assemble our SuperBowlOnARoll stack
     def __init__(self, name):
         super(AWSFrederickCommonTemplate, self).__init__(name)
-        self.load_policy_map()
+        self._rendered_json = None
+
+    def prebuild(self, parent):
+        """
+        Runs the child side of environmentbase's process_child_template
+        (common parameters, build_hook and json rendering) ahead of time so the
+        controller can build independent child templates concurrently
+        @param parent [Template] template this child is attached to
+        """
+        self.add_common_parameters_from_parent(parent)
+        with self.profiler.phase('build_hook', self.name):
+            self.build_hook()
+
+        # Render now, but keep the generated outputs out of the template until
+        # the parent has wired the child's outputs, as in a serial build
+        with self.profiler.phase('to_json', self.name):
+            self._rendered_json = super(AWSFrederickCommonTemplate, self).to_template_json()
+        for output_key in ['dateGenerated', 'templateValidationHash']:
+            self.outputs.pop(output_key, None)
+
+        # process_child_template repeats these calls, the template is complete
+        self.add_common_parameters_from_parent = lambda parent: None
+        self.build_hook = lambda: None
+
+    def to_template_json(self):
+        if self._rendered_json is not None:
+            return self._rendered_json
+        return super(AWSFrederickCommonTemplate, self).to_template_json()
+
+    def add_resource(self, resource):
+        # Called for every troposphere object, skip the profiler entirely
+        # unless it is on
+        if not self.profiler.enabled:
+            return super(AWSFrederickCommonTemplate, self).add_resource(resource)
+
+        with self.profiler.phase('add_resource', self.name):
+            return super(AWSFrederickCommonTemplate, self).add_resource(resource)
 
     def add_alarm(self, name, dimensions, alarm, description, namespace, threshold, comparison_operator, statistic, metric_name):
         return self.add_resource(
@@ -61,7 +276,120 @@ class AWSFrederickCommonTemplate(Template):
             )
         )
 
-    def add_bucket(self, name, access_control, static_site, route53, public_hosted_zone):
+    def add_target_tracking_policy(self, name, asg, metric_type, target, resource_label=None):
+        """
+        Helper to keep a predefined asg metric at a target value
+        @param name [string] name of the scaling policy
+        @param asg [AutoScalingGroup] group being scaled
+        @param metric_type [string] predefined metric, e.g. ASGAverageCPUUtilization
+        @param target [float] value the metric is kept at
+        @param resource_label [string] identifies the target group for
+        ALBRequestCountPerTarget
+        """
+        metric = autoscaling.PredefinedMetricSpecification(PredefinedMetricType=metric_type)
+        if resource_label is not None:
+            metric.ResourceLabel = resource_label
+
+        return self.add_resource(
+            autoscaling.ScalingPolicy(
+                name,
+                AutoScalingGroupName=Ref(asg),
+                PolicyType='TargetTrackingScaling',
+                EstimatedInstanceWarmup=300,
+                TargetTrackingConfiguration=autoscaling.TargetTrackingConfiguration(
+                    PredefinedMetricSpecification=metric,
+                    TargetValue=float(target)
+                )
+            )
+        )
+
+    def add_step_scaling_policy(self, name, asg, step_adjustments):
+        """
+        Helper to change an asg's capacity in steps when an alarm fires
+        @param name [string] name of the scaling policy
+        @param asg [AutoScalingGroup] group being scaled
+        @param step_adjustments [StepAdjustments[]] capacity change per
+        distance from the alarm threshold
+        """
+        return self.add_resource(
+            autoscaling.ScalingPolicy(
+                name,
+                AutoScalingGroupName=Ref(asg),
+                PolicyType='StepScaling',
+                AdjustmentType='ChangeInCapacity',
+                MetricAggregationType='Average',
+                EstimatedInstanceWarmup=300,
+                StepAdjustments=step_adjustments
+            )
+        )
+
+    def add_ecs_scalable_target(self, name, cluster, service, min_capacity, max_capacity, role):
+        """
+        Helper to let Application Auto Scaling own an ecs service's desired
+        count
+        @param name [string] name of the scalable target
+        @param cluster [Cluster] cluster running the service
+        @param service [Service] service being scaled
+        @param min_capacity [int] fewest tasks
+        @param max_capacity [int] most tasks
+        @param role [Role] role Application Auto Scaling acts as
+        """
+        return self.add_resource(
+            applicationautoscaling.ScalableTarget(
+                name,
+                MinCapacity=min_capacity,
+                MaxCapacity=max_capacity,
+                ResourceId=Join('/', ['service', Ref(cluster), GetAtt(service, 'Name')]),
+                RoleARN=GetAtt(role, 'Arn'),
+                ScalableDimension='ecs:service:DesiredCount',
+                ServiceNamespace='ecs'
+            )
+        )
+
+    def add_service_target_tracking_policy(self, name, scalable_target, metric_type, target,
+                                           scale_in_cooldown=300, scale_out_cooldown=60, resource_label=None):
+        """
+        Helper to keep a predefined Application Auto Scaling metric at a
+        target value
+        @param name [string] name of the scaling policy
+        @param scalable_target [ScalableTarget] target being scaled
+        @param metric_type [string] predefined metric, e.g.
+        ECSServiceAverageCPUUtilization
+        @param target [float] value the metric is kept at
+        @param scale_in_cooldown [int] seconds between scale in activities
+        @param scale_out_cooldown [int] seconds between scale out activities
+        @param resource_label [string] identifies the target group for
+        ALBRequestCountPerTarget
+        """
+        metric = applicationautoscaling.PredefinedMetricSpecification(PredefinedMetricType=metric_type)
+        if resource_label is not None:
+            metric.ResourceLabel = resource_label
+
+        return self.add_resource(
+            applicationautoscaling.ScalingPolicy(
+                name,
+                PolicyName=name,
+                PolicyType='TargetTrackingScaling',
+                ScalingTargetId=Ref(scalable_target),
+                TargetTrackingScalingPolicyConfiguration=applicationautoscaling.TargetTrackingScalingPolicyConfiguration(
+                    PredefinedMetricSpecification=metric,
+                    TargetValue=float(target),
+                    ScaleInCooldown=scale_in_cooldown,
+                    ScaleOutCooldown=scale_out_cooldown
+                )
+            )
+        )
+
+    def get_secret(self, ciphertext):
+        """
+        Helper returns the plaintext of a KMS encrypted config value
+        @param ciphertext [string] base64 encoded KMS ciphertext blob
+        """
+        return self.secrets.decrypt(ciphertext)
+
+    def add_bucket(self, name, access_control, static_site, route53, public_hosted_zone,
+                   transfer_acceleration=False, lifecycle=None, intelligent_tiering=None,
+                   request_metrics=None):
         """
         Helper method creates a directory service resource
         @param name [string] Fully qualified name for the bucket
@@ -69,6 +397,16 @@ class AWSFrederickCommonTemplate(Template):
         @param access_control [string] type of access control for the bucket
         @param static_site [boolean] should the bucket host a static site
         @param route53 [boolean] create a route53 entry?
+        @param transfer_acceleration [boolean] accept uploads through the
+        S3 Transfer Acceleration edge endpoint
+        @param lifecycle [dict] transitions ({days, storage_class} list),
+        expiration_days, abort_multipart_days and prefix of the lifecycle
+        rules
+        @param intelligent_tiering [dict|boolean] move objects to
+        Intelligent-Tiering after transition_days, archive_days and
+        deep_archive_days enable the archive tiers
+        @param request_metrics [list|boolean] prefixes to publish CloudWatch
+        request metrics for, true for the whole bucket
         """
 
         if route53:
@@ -107,8 +445,115 @@ class AWSFrederickCommonTemplate(Template):
             web_config = s3.WebsiteConfiguration(IndexDocument='index.html')
             bucket.properties['WebsiteConfiguration'] = web_config
 
+        if transfer_acceleration:
+            if '.' in name:
+                raise ValueError('Transfer acceleration needs a bucket name without dots: %s' % name)
+            bucket.AccelerateConfiguration = s3.AccelerateConfiguration(AccelerationStatus='Enabled')
+
+        lifecycle_rules = self.get_bucket_lifecycle_rules(lifecycle or {}, intelligent_tiering)
+        if lifecycle_rules:
+            bucket.LifecycleConfiguration = s3.LifecycleConfiguration(Rules=lifecycle_rules)
+
+        if isinstance(intelligent_tiering, dict) and \
+                (intelligent_tiering.get('archive_days') or intelligent_tiering.get('deep_archive_days')):
+            # Archived objects need a restore before they can be read again,
+            # only for buckets whose readers can wait for one. troposphere
+            # 2.2.1 predates IntelligentTieringConfigurations
+            tierings = []
+            if intelligent_tiering.get('archive_days'):
+                tierings.append({'AccessTier': 'ARCHIVE_ACCESS', 'Days': int(intelligent_tiering['archive_days'])})
+            if intelligent_tiering.get('deep_archive_days'):
+                tierings.append({'AccessTier': 'DEEP_ARCHIVE_ACCESS', 'Days': int(intelligent_tiering['deep_archive_days'])})
+            bucket.properties['IntelligentTieringConfigurations'] = [{
+                'Id': 'ArchiveTiers',
+                'Status': 'Enabled',
+                'Tierings': tierings
+            }]
+
+        if request_metrics:
+            if request_metrics is True:
+                bucket.MetricsConfigurations = [s3.MetricsConfiguration(Id='EntireBucket')]
+            else:
+                bucket.MetricsConfigurations = [
+                    s3.MetricsConfiguration(Id=prefix.strip('/').replace('/', '-') or 'EntireBucket', Prefix=prefix)
+                    for prefix in request_metrics
+                ]
+
         return self.add_resource(bucket)
 
+    @staticmethod
+    def get_bucket_lifecycle_rules(lifecycle, intelligent_tiering):
+        """
+        Returns the lifecycle rules for a bucket's lifecycle and
+        intelligent_tiering config
+        """
+        rules = []
+        prefix = lifecycle.get('prefix')
+
+        steps = [(int(transition['days']), transition['storage_class'])
+                 for transition in lifecycle.get('transitions', [])]
+        if intelligent_tiering:
+            transition_days = 0
+            if isinstance(intelligent_tiering, dict):
+                transition_days = int(intelligent_tiering.get('transition_days', 0))
+            steps.append((transition_days, 'INTELLIGENT_TIERING'))
+
+        AWSFrederickCommonTemplate.check_lifecycle_transitions(sorted(steps))
+        transitions = [
+            s3.LifecycleRuleTransition(StorageClass=storage_class, TransitionInDays=days)
+            for days, storage_class in sorted(steps)
+        ]
+
+        if transitions or lifecycle.get('expiration_days'):
+            rule = s3.LifecycleRule(Id='Tiering', Status='Enabled')
+            if transitions:
+                rule.Transitions = transitions
+            if lifecycle.get('expiration_days'):
+                rule.ExpirationInDays = int(lifecycle['expiration_days'])
+            if prefix:
+                rule.Prefix = prefix
+            rules.append(rule)
+
+        # Applies to the whole bucket, parts of abandoned uploads are billed
+        # until they are aborted
+        if lifecycle.get('abort_multipart_days'):
+            rules.append(s3.LifecycleRule(
+                Id='AbortIncompleteMultipartUploads',
+                Status='Enabled',
+                AbortIncompleteMultipartUpload=s3.AbortIncompleteMultipartUpload(
+                    DaysAfterInitiation=int(lifecycle['abort_multipart_days'])
+                )
+            ))
+
+        return rules
+
+    @staticmethod
+    def check_lifecycle_transitions(steps):
+        """
+        Raises a ValueError unless the transitions move objects down
+        LIFECYCLE_STORAGE_CLASSES, each one later than the one before
+        @param steps [list] (days, storage class) sorted by days
+        """
+        classes = [storage_class for storage_class, _ in AWSFrederickCommonTemplate.LIFECYCLE_STORAGE_CLASSES]
+        min_days = dict(AWSFrederickCommonTemplate.LIFECYCLE_STORAGE_CLASSES)
+
+        previous = None
+        for days, storage_class in steps:
+            if storage_class not in classes:
+                raise ValueError('Unknown lifecycle storage class %s, expected one of %s' % (
+                    storage_class, ', '.join(classes)))
+            if days < min_days[storage_class]:
+                raise ValueError('Lifecycle transition to %s needs at least %d days, got %d' % (
+                    storage_class, min_days[storage_class], days))
+            if previous is not None:
+                if days == previous[0]:
+                    raise ValueError('Lifecycle transitions to %s and %s are both at %d days' % (
+                        previous[1], storage_class, days))
+                if classes.index(storage_class) <= classes.index(previous[1]):
+                    raise ValueError('Lifecycle transition to %s at %d days cannot follow %s at %d days' % (
+                        storage_class, days, previous[1], previous[0]))
+            previous = (days, storage_class)
+
     def add_role(self, name, principal_services, policies, path='/'):
         """
         Helper method for creating roles with pre defined policies
@@ -130,447 +575,69 @@ class AWSFrederickCommonTemplate(Template):
             Policies=policies_for_role
         ))
 
-    def load_policy_map(self):
-        # TODO: move these to a flat config file & load from that
-        self.POLICY_MAP = {
-            'kms': iam.Policy(
-                PolicyName='kmsInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Sid": "Stmt1457395497000",
-                        "Effect": "Allow",
-                        "Action": [
-                            "kms:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'autoscaling': iam.Policy(
-                PolicyName='asgInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "autoscaling:*",
-                            "ec2:*",
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'cloudwatch': iam.Policy(
-                PolicyName='cwInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "sns:*",
-                            "autoscaling:Describe*",
-                            "cloudwatch:*",
-                            "logs:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'cloudwatchlogs': iam.Policy(
-                PolicyName='cloudwatchlogs',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "logs:CreateLogGroup",
-                            "logs:CreateLogStream",
-                            "logs:PutLogEvents",
-                            "logs:DescribeLogStreams"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'autoscaling_ecs': iam.Policy(
-                PolicyName='service-autoscaling',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "application-autoscaling:*",
-                            "cloudwatch:DescribeAlarms",
-                            "cloudwatch:PutMetricAlarm",
-                            "ecs:DescribeServices",
-                            "ecs:UpdateService"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'sns': iam.Policy(
-                PolicyName='snsInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "sns:*",
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            's3': iam.Policy(
-                PolicyName='s3Interact',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "s3:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'ecr': iam.Policy(
-                PolicyName='ecrInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "ecr:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'ecs': iam.Policy(
-                PolicyName='ecsInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "elasticloadbalancing:Describe*",
-                            "elasticloadbalancing:DeregisterInstancesFromLoadBalancer",
-                            "elasticloadbalancing:RegisterInstancesWithLoadBalancer",
-                            "ec2:Describe*",
-                            "ec2:AuthorizeSecurityGroupIngress",
-                            "ecs:RegisterContainerInstance",
-                            "ecs:DeregisterContainerInstance",
-                            "ecs:DiscoverPollEndpoint",
-                            "ecs:Submit*",
-                            "ecs:Poll",
-                            "ecs:StartTelemetrySession",
-                            "application-autoscaling:*",
-                            "cloudwatch:DescribeAlarms",
-                            "cloudwatch:PutMetricAlarm",
-                            "ecs:DescribeServices",
-                            "ecs:UpdateService"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'ses': iam.Policy(
-                PolicyName='sesInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "ses:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'sqs': iam.Policy(
-                PolicyName='sqsInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "sqs:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'route53': iam.Policy(
-                PolicyName='route53Interact',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "route53:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'createtags': iam.Policy(
-                PolicyName='createtags',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "ec2:CreateTags",
-                            "ec2:DescribeInstances",
-                            "ec2:DescribeTags",
-                            "ec2:DescribeVolumes"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'es': iam.Policy(
-                PolicyName='esInteract',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "es:*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'lambda': iam.Policy(
-                PolicyName='lambda',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "cloudwatch:*",
-                            "cognito-identity:ListIdentityPools",
-                            "cognito-sync:GetCognitoEvents",
-                            "cognito-sync:SetCognitoEvents",
-                            "dynamodb:*",
-                            "events:*",
-                            "iam:ListAttachedRolePolicies",
-                            "iam:ListRolePolicies",
-                            "iam:ListRoles",
-                            "iam:PassRole",
-                            "kinesis:DescribeStream",
-                            "kinesis:ListStreams",
-                            "kinesis:PutRecord",
-                            "lambda:*",
-                            "logs:*",
-                            "s3:*",
-                            "sns:ListSubscriptions",
-                            "sns:ListSubscriptionsByTopic",
-                            "sns:ListTopics",
-                            "sns:Subscribe",
-                            "sns:Unsubscribe"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'readall': iam.Policy(
-                PolicyName='readall',
-                PolicyDocument={
-                    "Statement": [{
-                        "Effect": "Allow",
-                        "Action": [
-                            "appstream:Get*",
-                            "autoscaling:Describe*",
-                            "cloudformation:DescribeStackEvents",
-                            "cloudformation:DescribeStackResource",
-                            "cloudformation:DescribeStackResources",
-                            "cloudformation:DescribeStacks",
-                            "cloudformation:GetTemplate",
-                            "cloudformation:List*",
-                            "cloudfront:Get*",
-                            "cloudfront:List*",
-                            "cloudsearch:Describe*",
-                            "cloudsearch:List*",
-                            "cloudtrail:DescribeTrails",
-                            "cloudtrail:GetTrailStatus",
-                            "cloudwatch:Describe*",
-                            "cloudwatch:Get*",
-                            "cloudwatch:List*",
-                            "codecommit:BatchGetRepositories",
-                            "codecommit:Get*",
-                            "codecommit:GitPull",
-                            "codecommit:List*",
-                            "codedeploy:Batch*",
-                            "codedeploy:Get*",
-                            "codedeploy:List*",
-                            "config:Deliver*",
-                            "config:Describe*",
-                            "config:Get*",
-                            "datapipeline:DescribeObjects",
-                            "datapipeline:DescribePipelines",
-                            "datapipeline:EvaluateExpression",
-                            "datapipeline:GetPipelineDefinition",
-                            "datapipeline:ListPipelines",
-                            "datapipeline:QueryObjects",
-                            "datapipeline:ValidatePipelineDefinition",
-                            "directconnect:Describe*",
-                            "dynamodb:BatchGetItem",
-                            "dynamodb:DescribeTable",
-                            "dynamodb:GetItem",
-                            "dynamodb:ListTables",
-                            "dynamodb:Query",
-                            "dynamodb:Scan",
-                            "ec2:Describe*",
-                            "ec2:GetConsoleOutput",
-                            "ecr:GetAuthorizationToken",
-                            "ecr:BatchCheckLayerAvailability",
-                            "ecr:GetDownloadUrlForLayer",
-                            "ecr:GetManifest",
-                            "ecr:DescribeRepositories",
-                            "ecr:ListImages",
-                            "ecr:BatchGetImage",
-                            "ecs:Describe*",
-                            "ecs:List*",
-                            "elasticache:Describe*",
-                            "elasticache:List*",
-                            "elasticbeanstalk:Check*",
-                            "elasticbeanstalk:Describe*",
-                            "elasticbeanstalk:List*",
-                            "elasticbeanstalk:RequestEnvironmentInfo",
-                            "elasticbeanstalk:RetrieveEnvironmentInfo",
-                            "elasticloadbalancing:Describe*",
-                            "elasticmapreduce:Describe*",
-                            "elasticmapreduce:List*",
-                            "elastictranscoder:List*",
-                            "elastictranscoder:Read*",
-                            "firehose:Describe*",
-                            "firehose:List*",
-                            "glacier:ListVaults",
-                            "glacier:DescribeVault",
-                            "glacier:GetDataRetrievalPolicy",
-                            "glacier:GetVaultAccessPolicy",
-                            "glacier:GetVaultLock",
-                            "glacier:GetVaultNotifications",
-                            "glacier:ListJobs",
-                            "glacier:ListMultipartUploads",
-                            "glacier:ListParts",
-                            "glacier:ListTagsForVault",
-                            "glacier:DescribeJob",
-                            "glacier:GetJobOutput",
-                            "iam:GenerateCredentialReport",
-                            "iam:Get*",
-                            "iam:List*",
-                            "inspector:Describe*",
-                            "inspector:Get*",
-                            "inspector:List*",
-                            "inspector:LocalizeText",
-                            "inspector:PreviewAgentsForResourceGroup",
-                            "iot:Describe*",
-                            "iot:Get*",
-                            "iot:List*",
-                            "kinesis:Describe*",
-                            "kinesis:Get*",
-                            "kinesis:List*",
-                            "kms:Describe*",
-                            "kms:Get*",
-                            "kms:List*",
-                            "lambda:List*",
-                            "lambda:Get*",
-                            "logs:Describe*",
-                            "logs:Get*",
-                            "logs:TestMetricFilter",
-                            "mobilehub:GetProject",
-                            "mobilehub:ListAvailableFeatures",
-                            "mobilehub:ListAvailableRegions",
-                            "mobilehub:ListProjects",
-                            "mobilehub:ValidateProject",
-                            "mobilehub:VerifyServiceRole",
-                            "opsworks:Describe*",
-                            "opsworks:Get*",
-                            "rds:Describe*",
-                            "rds:ListTagsForResource",
-                            "redshift:Describe*",
-                            "redshift:ViewQueriesInConsole",
-                            "route53:Get*",
-                            "route53:List*",
-                            "route53domains:CheckDomainAvailability",
-                            "route53domains:GetDomainDetail",
-                            "route53domains:GetOperationDetail",
-                            "route53domains:ListDomains",
-                            "route53domains:ListOperations",
-                            "route53domains:ListTagsForDomain",
-                            "s3:Get*",
-                            "s3:List*",
-                            "sdb:GetAttributes",
-                            "sdb:List*",
-                            "sdb:Select*",
-                            "ses:Get*",
-                            "ses:List*",
-                            "sns:Get*",
-                            "sns:List*",
-                            "sqs:GetQueueAttributes",
-                            "sqs:ListQueues",
-                            "sqs:ReceiveMessage",
-                            "storagegateway:Describe*",
-                            "storagegateway:List*",
-                            "swf:Count*",
-                            "swf:Describe*",
-                            "swf:Get*",
-                            "swf:List*",
-                            "tag:Get*",
-                            "trustedadvisor:Describe*",
-                            "waf:Get*",
-                            "waf:List*"
-                        ],
-                        "Resource": "*"
-                    }]
-                }
-            ),
-            'simianarmy': iam.Policy(
-                PolicyName='SimianArmyInteract',
-                PolicyDocument={
-                    "Statement": [
-                        {
-                            "Effect": "Allow",
-                            "Resource": "*",
-                            "Sid": "Stmt1357739573947",
-                            "Action": [
-                                "ec2:CreateTags",
-                                "ec2:DeleteSnapshot",
-                                "ec2:DescribeImages",
-                                "ec2:DescribeInstances",
-                                "ec2:DescribeSnapshots",
-                                "ec2:DescribeVolumes",
-                                "ec2:TerminateInstances",
-                                "ses:SendEmail",
-                                "elasticloadbalancing:*"
-                            ]
-                        },
-                        {
-                            "Effect": "Allow",
-                            "Resource": "*",
-                            "Sid": "Stmt1357739649609",
-                            "Action": [
-                                "autoscaling:DeleteAutoScalingGroup",
-                                "autoscaling:DescribeAutoScalingGroups",
-                                "autoscaling:DescribeAutoScalingInstances",
-                                "autoscaling:DescribeLaunchConfigurations"
-                            ]
-                        },
-                        {
-                            "Effect": "Allow",
-                            "Resource": "*",
-                            "Sid": "Stmt1357739730279",
-                            "Action": [
-                                "sdb:BatchDeleteAttributes",
-                                "sdb:BatchPutAttributes",
-                                "sdb:DomainMetadata",
-                                "sdb:GetAttributes",
-                                "sdb:PutAttributes",
-                                "sdb:ListDomains",
-                                "sdb:CreateDomain",
-                                "sdb:Select"
-                            ]
-                        }
-                    ]
-                }
-            )
-        }
+    @staticmethod
+    def load_policy_map():
+        """
+        Loads the IAM policies from POLICY_FILE on first use. The parsed map is
+        shared by every template in the process, so entries must be treated as
+        read only
+        """
+        cls = AWSFrederickCommonTemplate
+        if not cls.POLICY_MAP:
+            with cls._policy_lock:
+                if not cls.POLICY_MAP:
+                    with open(cls.POLICY_FILE) as policy_file:
+                        policies = json.load(policy_file)
+                    cls.POLICY_MAP = dict(
+                        (policy_type, iam.Policy(**policy)) for policy_type, policy in policies.items()
+                    )
+        return cls.POLICY_MAP
 
     def get_policy(self, policy_type, receiver_name):
         print("WARNING: Allowing %s access for %s" % (policy_type, receiver_name))
 
-        return self.POLICY_MAP.get(policy_type)
+        return self.load_policy_map().get(policy_type)
+
+    def add_lambda_function(self, name, source, role, environment, files=None, handler='main.lambda_handler',
+                            runtime='python3.12', timeout=30, memory_size=128, reserved_concurrency=None):
+        """
+        Helper that creates a lambda function from a lambda/ source directory,
+        deployed from the template bucket
+        @param name [string] name of the function
+        @param source [string] directory under lambda/ holding the sources
+        @param role [Role] execution role of the function
+        @param environment [dict] environment variables of the function
+        @param files [list] files of the source directory to package,
+        defaults to main.py
+        @param handler [string] module.function called per invocation
+        @param runtime [string] lambda runtime
+        @param timeout [int] seconds an invocation may run
+        @param memory_size [int] MB of memory for the function
+        @param reserved_concurrency [int] caps concurrent invocations
+        """
+        package = AWSFrederickLambdaPackage(name, os.path.join(self.LAMBDA_DIR, source), files or ['main.py'])
+        resource_path = package.content_path(Template.s3_path_prefix)
+        with self._lambda_lock:
+            AWSFrederickCommonTemplate.lambda_packages[resource_path] = package
+
+        function = awslambda.Function(
+            name + 'Function',
+            Code=awslambda.Code(
+                S3Bucket=Ref(Template.template_bucket_param),
+                S3Key=resource_path
+            ),
+            Handler=handler,
+            Role=GetAtt(role, 'Arn'),
+            Runtime=runtime,
+            Timeout=timeout,
+            MemorySize=memory_size,
+            Environment=awslambda.Environment(Variables=environment)
+        )
+
+        if reserved_concurrency is not None:
+            function.ReservedConcurrentExecutions = reserved_concurrency
+
+        return self.add_resource(function)
 
     def add_sqs_queue(
         self,
@@ -632,6 +699,47 @@ class AWSFrederickCommonTemplate(Template):
             VPCs=[route53.HostedZoneVPCs(VPCId=Ref(self.vpc_id), VPCRegion=region)]
         ))
 
+    def add_private_dns_namespace(self, name, namespace):
+        """
+        Helper that creates a Cloud Map namespace, Cloud Map manages its
+        private hosted zone in the vpc
+        @param name [string] logical name of the namespace
+        @param namespace [string] domain the namespace serves, e.g.
+        internal.example.org
+        """
+        return self.add_resource(servicediscovery.PrivateDnsNamespace(
+            name,
+            Name=namespace.rstrip('.'),
+            Vpc=self.vpc_id,
+            Description='Service discovery for ' + self.name
+        ))
+
+    def add_discovery_service(self, name, namespace, record_types, ttl, failure_threshold=1):
+        """
+        Helper that creates a Cloud Map service answering with one record per
+        healthy instance. Instances are kept healthy by whoever registers
+        them, e.g. ECS
+        @param name [string] name of the service in the namespace
+        @param namespace [PrivateDnsNamespace] namespace the service is in
+        @param record_types [list] A, AAAA or SRV
+        @param ttl [int] TTL of the records in seconds
+        @param failure_threshold [int] unhealthy reports before an instance
+        is left out of the answers
+        """
+        service = servicediscovery.Service(
+            name.replace('-', '').replace('_', '') + 'DiscoveryService',
+            Name=name,
+            DnsConfig=servicediscovery.DnsConfig(
+                NamespaceId=Ref(namespace),
+                DnsRecords=[servicediscovery.DnsRecord(Type=record_type, TTL=str(ttl))
+                            for record_type in record_types]
+            )
+        )
+        # troposphere 2.2.1 predates routing policies and custom health checks
+        service.DnsConfig.properties['RoutingPolicy'] = 'MULTIVALUE'
+        service.properties['HealthCheckCustomConfig'] = {'FailureThreshold': failure_threshold}
+        return self.add_resource(service)
+
     def add_scheduled_action(
         self,
         name,
@@ -661,6 +769,123 @@ class AWSFrederickCommonTemplate(Template):
             MinSize=min_size,
         ))
 
+    def add_cloudfront_distribution(self, name, aliases, origin, default_cache_behavior, cache_behaviors,
+                                    acm_cert, price_class='PriceClass_100', http_version='http2',
+                                    default_root_object=None):
+        """
+        Helper to put a CloudFront distribution in front of a single origin
+        @param name [string] name of the distribution resource
+        @param aliases [string[]] domain names the distribution serves
+        @param origin [Origin] origin the behaviors target
+        @param default_cache_behavior [DefaultCacheBehavior] behavior for
+        paths no other behavior matches
+        @param cache_behaviors [CacheBehavior[]] behaviors by path pattern,
+        first match wins
+        @param acm_cert [string] us-east-1 ACM certificate arn for the aliases
+        @param price_class [string] PriceClass_100, PriceClass_200 or
+        PriceClass_All
+        @param http_version [string] http1.1 or http2
+        @param default_root_object [string] object returned for the root url
+        """
+        distribution_config = cloudfront.DistributionConfig(
+            Aliases=aliases,
+            Origins=[origin],
+            DefaultCacheBehavior=default_cache_behavior,
+            Enabled=True,
+            HttpVersion=http_version,
+            PriceClass=price_class,
+            ViewerCertificate=cloudfront.ViewerCertificate(
+                AcmCertificateArn=acm_cert,
+                SslSupportMethod='sni-only'
+            )
+        )
+
+        if cache_behaviors:
+            distribution_config.CacheBehaviors = cache_behaviors
+        if default_root_object:
+            distribution_config.DefaultRootObject = default_root_object
+
+        return self.add_resource(cloudfront.Distribution(
+            name.replace('.', '').replace('-', ''),
+            DistributionConfig=distribution_config
+        ))
+
+    @staticmethod
+    def get_cloudfront_cache_behavior(origin_id, path_pattern=None, forward_all=False, compress=True,
+                                      min_ttl=0, default_ttl=86400, max_ttl=31536000, query_string=True):
+        """
+        Returns a cache behavior for the origin, the default behavior when no
+        path pattern is given
+        @param origin_id [string] Id of the origin the behavior targets
+        @param path_pattern [string] paths the behavior applies to
+        @param forward_all [bool] forward every header, cookie and query
+        string and accept every method, for dynamic content that must not
+        be cached
+        @param compress [bool] gzip compressible responses at the edge
+        @param min_ttl [int] seconds objects are cached at least
+        @param default_ttl [int] seconds objects without cache headers are
+        cached
+        @param max_ttl [int] seconds objects are cached at most
+        @param query_string [bool] forward query strings and make them part
+        of the cache key
+        """
+        if forward_all:
+            forwarded_values = cloudfront.ForwardedValues(
+                QueryString=True,
+                Headers=['*'],
+                Cookies=cloudfront.Cookies(Forward='all')
+            )
+            allowed_methods = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'POST', 'DELETE']
+            min_ttl = default_ttl = max_ttl = 0
+        else:
+            forwarded_values = cloudfront.ForwardedValues(
+                QueryString=query_string,
+                Cookies=cloudfront.Cookies(Forward='none')
+            )
+            allowed_methods = ['GET', 'HEAD', 'OPTIONS']
+
+        behavior = dict(
+            TargetOriginId=origin_id,
+            ForwardedValues=forwarded_values,
+            ViewerProtocolPolicy='redirect-to-https',
+            AllowedMethods=allowed_methods,
+            CachedMethods=['GET', 'HEAD'],
+            Compress=compress,
+            MinTTL=min_ttl,
+            DefaultTTL=default_ttl,
+            MaxTTL=max_ttl
+        )
+
+        if path_pattern is None:
+            return cloudfront.DefaultCacheBehavior(**behavior)
+        return cloudfront.CacheBehavior(PathPattern=path_pattern, **behavior)
+
+    def add_cloudfront_dns_alias(self, distribution, name, zone_name, title=None):
+        """
+        Helper to attach an alias dns entry to a CloudFront distribution
+        @param distribution [Distribution] target distribution
+        @param name [string] domain name of the record
+        @param zone_name [string] hostzone name
+        @param title [string] logical id of the record set group, to take
+        over a record another resource type used to own
+        """
+        return self.add_resource(
+            route53.RecordSetGroup(
+                title or name.replace('.', '').replace('-', '') + "AliasRecordSetGroup" + zone_name.replace('.', ''),
+                HostedZoneName=zone_name.lower(),
+                RecordSets=[
+                    route53.RecordSet(
+                        Name=name.lower(),
+                        Type='A',
+                        AliasTarget=route53.AliasTarget(
+                            self.CLOUDFRONT_HOSTED_ZONE_ID,
+                            GetAtt(distribution, 'DomainName')
+                        )
+                    )
+                ]
+            )
+        )
+
     def add_elb_dns_alias(self, elb, name, zone_name):
         """
         Helper to attach an alias dns entry to an elb
@@ -674,7 +899,7 @@ class AWSFrederickCommonTemplate(Template):
             name = zone_name.lower()
         return self.add_resource(
             route53.RecordSetGroup(
-                name.replace('.', '') + "ELBRecordSetGroup" + zone_name.replace('.', ''),
+                ''.join(c for c in name if c.isalnum()) + "ELBRecordSetGroup" + zone_name.replace('.', ''),
                 HostedZoneName=zone_name.lower(),
                 RecordSets=[
                     route53.RecordSet(
@@ -1007,6 +1232,35 @@ class AWSFrederickCommonTemplate(Template):
 
         return self.add_resource(rds_database)
 
+    def add_rds_read_replica(self, name, index, source, engine, instance_type, rds_security_group,
+                             parameter_group_name, az_count):
+        """
+        Helper to add a read replica of an RDS instance. Replicas inherit the
+        subnet group, storage and encryption of their source and are placed
+        round robin across the availability zones
+        @param name [string] name of the source database
+        @param index [int] number of this replica
+        @param source [DBInstance] instance being replicated
+        @param engine [string] engine of the source instance
+        @param instance_type [string] instance class of the replica
+        @param rds_security_group [SecurityGroup] security group for the replica
+        @param parameter_group_name [DBParameterGroup] parameter group for the replica
+        @param az_count [int] number of availability zones to spread across
+        """
+        print "Adding RDS read replica %d for %s" % (index, name)
+        return self.add_resource(DBInstance(
+            'rds' + name + 'Replica%d' % index,
+            SourceDBInstanceIdentifier=Ref(source),
+            Engine=engine,
+            DBInstanceClass=instance_type,
+            StorageType='gp2',
+            AvailabilityZone=Select(index % az_count, GetAZs('')),
+            DBParameterGroupName=Ref(parameter_group_name),
+            VPCSecurityGroups=[Ref(rds_security_group)],
+            DeletionPolicy='Delete',
+            Tags=Tags(Name='%s-replica%d' % (name, index))
+        ))
+
     def add_rds_db_subnet(self, name, subnet):
         return self.add_resource(DBSubnetGroup(
             name + "DBSubnetGroup",
@@ -1052,6 +1306,38 @@ class AWSFrederickCommonTemplate(Template):
             )
         )
 
+    def add_rds_reader_dns_alias(self, replicas, name, zone_name):
+        """
+        Helper to attach a reader dns entry, next to the writer alias, that
+        spreads lookups evenly across the read replicas with weighted records
+        @param replicas [DBInstance[]] read replicas behind the reader name
+        @param name [string] name of the domain
+        @param zone_name [string] hostzone name
+        """
+        if 'admin' in zone_name:
+            record_name = 'rds' + name + '-reader.' + zone_name
+        else:
+            record_name = name + '-reader.rds.' + zone_name
+
+        return self.add_resource(
+            route53.RecordSetGroup(
+                name.replace(".", "") + "RDSReaderRecordSetGroup",
+                HostedZoneName=zone_name,
+                RecordSets=[
+                    route53.RecordSet(
+                        Name=record_name,
+                        Type='CNAME',
+                        TTL='60',
+                        SetIdentifier=replica.title,
+                        Weight=1,
+                        ResourceRecords=[
+                            GetAtt(replica, "Endpoint.Address")
+                        ]
+                    ) for replica in replicas
+                ]
+            )
+        )
+
     def add_kms_key(self, name):
         print('Adding KMS key for %s service' % name)
 
@@ -1147,6 +1433,17 @@ class AWSFrederickCommonTemplate(Template):
             CacheSubnetGroupName=Ref(subnet_group)
         ))
 
+    @staticmethod
+    def elasticache_dns_name(name, engine, zone_name):
+        """
+        Returns the record name add_elasticache_dns_alias creates, so other
+        stacks can reach the cluster without a cross stack reference
+        @param name [string] name of the cache cluster
+        @param engine [string] redis or memcached
+        @param zone_name [string] hostzone name
+        """
+        return name + engine + '.' + zone_name
+
     def add_elasticache_dns_alias(self, cluster, name, engine, zone_name):
         if engine == 'redis':
             address = "RedisEndpoint.Address"
@@ -1158,7 +1455,7 @@ class AWSFrederickCommonTemplate(Template):
             HostedZoneName=zone_name,
             RecordSets=[
                 route53.RecordSet(
-                    Name=name + engine + '.' + zone_name,
+                    Name=self.elasticache_dns_name(name, engine, zone_name),
                     Type='CNAME',
                     TTL='60',
                     ResourceRecords=[
@@ -1170,7 +1467,11 @@ class AWSFrederickCommonTemplate(Template):
         )
 
     def add_elasticache_subnet_group(self, name, engine, private_subnets):
-        return self.add_resource(elasticache.SubnetGroup(Description=name + engine + 'SubnetGroup', SubnetIds=private_subnets))
+        return self.add_resource(elasticache.SubnetGroup(
+            name + engine + 'SubnetGroup',
+            Description=name + engine + 'SubnetGroup',
+            SubnetIds=private_subnets
+        ))
 
     def add_ecr(self, container_name):
         print 'Creating ECR for %s' % container_name
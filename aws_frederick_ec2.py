@@ -6,8 +6,12 @@ import troposphere.constants as tpc
 import troposphere.autoscaling as autoscaling
 import troposphere.cloudwatch as cloudwatch
 import troposphere.route53 as r53
+import troposphere.awslambda as awslambda
+import troposphere.sns as sns
+import troposphere.sqs as sqs
 from troposphere.ec2 import SecurityGroup, SecurityGroupRule
 from troposphere.efs import FileSystem, MountTarget
+from troposphere.cloudfront import Origin, CustomOrigin
 
 
 class AWSFrederickEC2Template(AWSFrederickCommonTemplate):
@@ -15,6 +19,82 @@ class AWSFrederickEC2Template(AWSFrederickCommonTemplate):
     Enhances basic template by providing AWS Frederick EC2 resources
     """
 
+    # ec2.scaling settings used when the config leaves them out, response
+    # times are in seconds
+    DEFAULT_SCALING = {
+        'max': 6,
+        'request_count_target': 1000,
+        'cpu_target': 60,
+        'response_time_high': 1.0,
+        'response_time_low': 0.25
+    }
+
+    # ec2.cloudfront settings used when the config leaves them out. The
+    # static paths are cached for static_ttl seconds unless the response
+    # says otherwise, WebDAV sync clients use the origin name since
+    # CloudFront does not pass PROPFIND and the other WebDAV methods
+    DEFAULT_CLOUDFRONT = {
+        'origin_name': 'origin',
+        'price_class': 'PriceClass_100',
+        'static_ttl': 86400,
+        'static_paths': [
+            '/core/js/*',
+            '/core/css/*',
+            '/core/img/*',
+            '/core/fonts/*',
+            '/apps/*/js/*',
+            '/apps/*/css/*',
+            '/apps/*/img/*'
+        ]
+    }
+
+    # ec2.efs settings used when the config leaves them out. rsize/wsize are
+    # in bytes, provisioned_throughput in MiB/s and the burst credit alarm
+    # threshold in bytes of credit, the alarm is only created when it is set
+    DEFAULT_EFS = {
+        'performance_mode': 'generalPurpose',
+        'throughput_mode': 'bursting',
+        'mount_path': '/var/www/nextcloud/data',
+        'rsize': 1048576,
+        'wsize': 1048576,
+        'nconnect': 4
+    }
+
+    # ec2.fscache settings used when the config leaves them out. The cache
+    # may fill cache_percent of its disk, volume_size (GiB) adds a dedicated
+    # EBS volume and device points the cache at an existing local disk
+    DEFAULT_FSCACHE = {
+        'cache_dir': '/var/cache/fscache',
+        'cache_percent': 90,
+        'volume_type': 'gp2'
+    }
+
+    # Block device the dedicated cache volume is attached as
+    FSCACHE_VOLUME_DEVICE = '/dev/sdf'
+
+    # ec2.failover settings used when the config leaves them out. The site
+    # is health checked every health_check_interval seconds and switched to
+    # maintenance once failure_threshold checks in a row failed. Route53
+    # only publishes health check metrics in us-east-1. The route53 mode
+    # needs maintenance_dns_name, the cloudfront mode flips the root object
+    # of distribution_id, defaulting to the site's distribution. Alarm
+    # notifications are queued and handed to the function in batches
+    # collected for up to debounce_seconds, 0 invokes it per notification
+    DEFAULT_FAILOVER = {
+        'mode': 'route53',
+        'maintenance_zone_id': AWSFrederickCommonTemplate.CLOUDFRONT_HOSTED_ZONE_ID,
+        'health_check_path': '/status.php',
+        'health_check_interval': 10,
+        'failure_threshold': 3,
+        'alarm_periods': 1,
+        'cache_seconds': 300,
+        'debounce_seconds': 10,
+        'batch_size': 100,
+        'timeout': 30,
+        'root_object': 'index.html',
+        'maintenance_root_object': 'maint.html'
+    }
+
     # Collect all the values we need to assemble our SuperBowlOnARoll stack
     def __init__(self, env_name, region, cidr_range, aws_frederick_config):
         super(AWSFrederickEC2Template, self).__init__(env_name + 'EC2')
@@ -35,23 +115,555 @@ class AWSFrederickEC2Template(AWSFrederickCommonTemplate):
                 ec2_config.get('instance_size'),
                 ec2_config.get('asg_size'),
                 ec2_config.get('acm_cert'),
+                ec2_config.get('scaling') or {},
+                ec2_config.get('efs') or {},
+                ec2_config.get('fscache'),
+                ec2_config.get('cloudfront'),
+                ec2_config.get('failover'),
                 self.cidr_range,
                 hosted_zone_name
             )
 
-    def add_ec2(self, ami_name, instance_type, asg_size, acm_cert, cidr, hosted_zone):
+    def add_asg_scaling_policies(self, name, asg, public_alb, target_group, listener, scaling):
+        """
+        Scales the asg on requests per target and cpu with target tracking,
+        and steps it out and in on the ALB response time
+        @param name [string] Prefix for the policy and alarm names
+        @param asg [AutoScalingGroup] group being scaled
+        @param public_alb [LoadBalancer] ALB in front of the group
+        @param target_group [TargetGroup] target group the group registers in
+        @param listener [Listener] listener forwarding to the target group
+        @param scaling [dict] overrides of DEFAULT_SCALING
+        """
+        scaling = dict(self.DEFAULT_SCALING, **scaling)
+        alb_dimensions = [cloudwatch.MetricDimension(
+            Name='LoadBalancer',
+            Value=GetAtt(public_alb, 'LoadBalancerFullName')
+        )]
+
+        request_count_policy = self.add_target_tracking_policy(
+            name + 'RequestCountPolicy',
+            asg,
+            'ALBRequestCountPerTarget',
+            scaling['request_count_target'],
+            resource_label=Join('/', [
+                GetAtt(public_alb, 'LoadBalancerFullName'),
+                GetAtt(target_group, 'TargetGroupFullName')
+            ])
+        )
+        # The request count metric only exists once the target group is
+        # attached to the load balancer
+        request_count_policy.DependsOn = listener.title
+
+        self.add_target_tracking_policy(
+            name + 'CPUPolicy',
+            asg,
+            'ASGAverageCPUUtilization',
+            scaling['cpu_target']
+        )
+
+        # One more instance per second of response time over the threshold
+        scale_out_policy = self.add_step_scaling_policy(
+            name + 'ScaleOutPolicy',
+            asg,
+            [autoscaling.StepAdjustments(MetricIntervalLowerBound=0, MetricIntervalUpperBound=1, ScalingAdjustment=1),
+             autoscaling.StepAdjustments(MetricIntervalLowerBound=1, ScalingAdjustment=2)]
+        )
+
+        # One less instance below the threshold and two less below half of
+        # it, response times cannot drop a full second under it
+        half_low = scaling['response_time_low'] / 2.0
+        scale_in_policy = self.add_step_scaling_policy(
+            name + 'ScaleInPolicy',
+            asg,
+            [autoscaling.StepAdjustments(MetricIntervalLowerBound=-half_low, MetricIntervalUpperBound=0,
+                                         ScalingAdjustment=-1),
+             autoscaling.StepAdjustments(MetricIntervalUpperBound=-half_low, ScalingAdjustment=-2)]
+        )
+
+        self.add_resource(
+            cloudwatch.Alarm(
+                name + 'ResponseTimeHigh',
+                MetricName='TargetResponseTime',
+                ComparisonOperator='GreaterThanThreshold',
+                Period=60,
+                EvaluationPeriods=3,
+                Statistic='Average',
+                Namespace='AWS/ApplicationELB',
+                AlarmDescription=name + 'ResponseTimeHigh',
+                Dimensions=alb_dimensions,
+                Threshold=str(scaling['response_time_high']),
+                AlarmActions=[
+                    Ref(scale_out_policy),
+                    'arn:aws:sns:us-east-1:422548007577:notify-pat'
+                ]
+            )
+        )
+
+        # Scale in is slower than scale out so the group does not flap
+        self.add_resource(
+            cloudwatch.Alarm(
+                name + 'ResponseTimeLow',
+                MetricName='TargetResponseTime',
+                ComparisonOperator='LessThanThreshold',
+                Period=300,
+                EvaluationPeriods=3,
+                Statistic='Average',
+                Namespace='AWS/ApplicationELB',
+                AlarmDescription=name + 'ResponseTimeLow',
+                Dimensions=alb_dimensions,
+                Threshold=str(scaling['response_time_low']),
+                AlarmActions=[Ref(scale_in_policy)]
+            )
+        )
+
+    def add_alb_cloudfront(self, public_alb, acm_cert, cloudfront, hosted_zone):
+        """
+        Serves the site through CloudFront. Static Nextcloud assets are cached
+        and compressed at the edge, everything else passes through uncached
+        to the ALB, which stays reachable under the origin name. Returns the
+        distribution
+        @param public_alb [LoadBalancer] ALB serving Nextcloud
+        @param acm_cert [string] certificate of the ALB, also used for the
+        distribution unless the cloudfront config sets acm_cert
+        @param cloudfront [dict|bool] overrides of DEFAULT_CLOUDFRONT
+        @param hosted_zone [string] Name of the hosted zone the site is served
+        from
+        """
+        cloudfront = dict(self.DEFAULT_CLOUDFRONT, **(cloudfront if isinstance(cloudfront, dict) else {}))
+        site_name = hosted_zone.rstrip('.')
+        origin_id = 'NextcloudALB'
+
+        # CloudFront checks the origin certificate against the origin's name,
+        # so the ALB is reached through a name in the certificate's zone
+        self.add_elb_dns_alias(public_alb, cloudfront['origin_name'], hosted_zone)
+
+        origin = Origin(
+            Id=origin_id,
+            DomainName=cloudfront['origin_name'] + '.' + site_name,
+            CustomOriginConfig=CustomOrigin(
+                OriginProtocolPolicy='https-only',
+                OriginSSLProtocols=['TLSv1.2'],
+                OriginReadTimeout=60
+            )
+        )
+
+        # Query strings stay in the cache key for versioned asset urls
+        static_behaviors = [
+            self.get_cloudfront_cache_behavior(
+                origin_id,
+                path_pattern=path,
+                default_ttl=cloudfront['static_ttl']
+            ) for path in cloudfront['static_paths']
+        ]
+
+        distribution = self.add_cloudfront_distribution(
+            self.env_name + 'Distribution',
+            [site_name],
+            origin,
+            self.get_cloudfront_cache_behavior(origin_id, forward_all=True),
+            static_behaviors,
+            cloudfront.get('acm_cert', acm_cert),
+            price_class=cloudfront['price_class']
+        )
+
+        # Same logical id as the ALB alias this replaces, so the record is
+        # updated in place instead of created twice
+        self.add_cloudfront_dns_alias(
+            distribution,
+            hosted_zone,
+            hosted_zone,
+            title=hosted_zone.lower().replace('.', '') + "ELBRecordSetGroup" + hosted_zone.replace('.', '')
+        )
+
+        return distribution
+
+    def add_failover(self, name, public_alb, distribution, health_check_host, failover, hosted_zone):
+        """
+        Health checks the site and switches it to a maintenance page while it
+        is down. The health check alarm notifies a topic in both directions
+        and the lambda/failover function does the switch, skipping it when
+        the site is already in the requested state. With debounce_seconds
+        the topic feeds a queue the function drains one batch at a time,
+        acting only on the newest alarm state of each batch
+        @param name [string] prefix of the failover resources
+        @param public_alb [LoadBalancer] ALB serving Nextcloud
+        @param distribution [Distribution] CloudFront distribution in front of
+        the ALB, None when the ALB serves the site directly
+        @param health_check_host [string] name reaching the ALB directly
+        @param failover [dict|bool] overrides of DEFAULT_FAILOVER
+        @param hosted_zone [string] Name of the hosted zone the site is served
+        from
+        """
+        failover = dict(self.DEFAULT_FAILOVER, **(failover if isinstance(failover, dict) else {}))
+        mode = failover['mode']
+
+        environment = {
+            'FAILOVER_MODE': mode,
+            'CACHE_SECONDS': str(failover['cache_seconds'])
+        }
+
+        if mode == 'route53':
+            if not failover.get('maintenance_dns_name'):
+                raise ValueError('ec2.failover mode route53 needs maintenance_dns_name')
+
+            if distribution is not None:
+                primary_dns_name = GetAtt(distribution, 'DomainName')
+                primary_zone_id = self.CLOUDFRONT_HOSTED_ZONE_ID
+            else:
+                primary_dns_name = GetAtt(public_alb, 'DNSName')
+                primary_zone_id = GetAtt(public_alb, 'CanonicalHostedZoneID')
+
+            environment.update({
+                'HOSTED_ZONE_NAME': hosted_zone,
+                'RECORD_NAME': hosted_zone.lower(),
+                'PRIMARY_DNS_NAME': primary_dns_name,
+                'PRIMARY_ZONE_ID': primary_zone_id,
+                'MAINTENANCE_DNS_NAME': failover['maintenance_dns_name'],
+                'MAINTENANCE_ZONE_ID': failover['maintenance_zone_id']
+            })
+        elif mode == 'cloudfront':
+            if failover.get('distribution_id'):
+                distribution_id = failover['distribution_id']
+            elif distribution is not None:
+                distribution_id = Ref(distribution)
+            else:
+                raise ValueError('ec2.failover mode cloudfront needs distribution_id or ec2.cloudfront')
+
+            environment.update({
+                'DISTRIBUTION_ID': distribution_id,
+                'ROOT_OBJECT': failover['root_object'],
+                'MAINTENANCE_ROOT_OBJECT': failover['maintenance_root_object']
+            })
+        else:
+            raise ValueError('Unknown ec2.failover mode %s, expected route53 or cloudfront' % mode)
+
+        debounce_seconds = failover['debounce_seconds']
+        policies = ['cloudwatchlogs', mode] + (['sqs'] if debounce_seconds else [])
+        role = self.add_role(name + 'Failover', ['lambda.amazonaws.com'], policies)
+
+        # One switch at a time, a second concurrent batch could apply an
+        # older state after a newer one
+        function = self.add_lambda_function(
+            name + 'Failover',
+            'failover',
+            role,
+            environment,
+            timeout=failover['timeout'],
+            reserved_concurrency=1 if debounce_seconds else None
+        )
+
+        if debounce_seconds:
+            topic = self.add_failover_queue(name, function, failover)
+        else:
+            topic = self.add_resource(sns.Topic(
+                name + 'FailoverTopic',
+                Subscription=[sns.Subscription(Endpoint=GetAtt(function, 'Arn'), Protocol='lambda')]
+            ))
+
+            self.add_resource(awslambda.Permission(
+                name + 'FailoverPermission',
+                Action='lambda:InvokeFunction',
+                FunctionName=Ref(function),
+                Principal='sns.amazonaws.com',
+                SourceArn=Ref(topic)
+            ))
+
+        health_check = self.add_resource(r53.HealthCheck(
+            name + 'HealthCheck',
+            HealthCheckConfig=r53.HealthCheckConfiguration(
+                Type='HTTPS',
+                FullyQualifiedDomainName=health_check_host,
+                Port=443,
+                ResourcePath=failover['health_check_path'],
+                EnableSNI=True,
+                RequestInterval=failover['health_check_interval'],
+                FailureThreshold=failover['failure_threshold']
+            )
+        ))
+
+        # Named so lambda/failover/fail.sh can force it into ALARM
+        return self.add_resource(
+            cloudwatch.Alarm(
+                name + 'HealthCheckAlarm',
+                AlarmName=self.env_name + '-failover',
+                MetricName='HealthCheckStatus',
+                ComparisonOperator='LessThanThreshold',
+                Period=60,
+                EvaluationPeriods=failover['alarm_periods'],
+                Statistic='Minimum',
+                Namespace='AWS/Route53',
+                AlarmDescription=name + 'HealthCheckAlarm',
+                Dimensions=[cloudwatch.MetricDimension(Name='HealthCheckId', Value=Ref(health_check))],
+                Threshold='1',
+                AlarmActions=[Ref(topic)],
+                OKActions=[Ref(topic)]
+            )
+        )
+
+    def add_efs(self, private_subnets, efs):
+        """
+        Creates the shared Nextcloud file system with a mount target in each
+        private subnet, and the optional burst credit alarm
+        @param private_subnets [string[]] names of the private subnet parameters
+        @param efs [dict] overrides of DEFAULT_EFS
+        """
+        efs = dict(self.DEFAULT_EFS, **efs)
+
+        efs_security_group_rule = SecurityGroupRule(
+            IpProtocol='tcp',
+            FromPort='2049',
+            ToPort='2049',
+            SourceSecurityGroupId=Ref(self.internal_security_group)
+        )
+
+        efs_security_group = SecurityGroup(
+            "SecurityGroup",
+            SecurityGroupIngress=[efs_security_group_rule],
+            VpcId=Ref('vpcId'),
+            GroupDescription="Allow NFS over TCP"
+        )
+        self.add_resource(efs_security_group)
+
+        tags = Tags(Name='EFSFileSystem')
+        efs_file_system = FileSystem(
+            "EFSFileSystem",
+            FileSystemTags=tags,
+            PerformanceMode=efs['performance_mode']
+        )
+
+        # troposphere 2.2.1 predates the throughput properties
+        efs_file_system.properties['ThroughputMode'] = efs['throughput_mode']
+        if efs['throughput_mode'] == 'provisioned':
+            if not efs.get('provisioned_throughput'):
+                raise ValueError('ec2.efs.provisioned_throughput (MiB/s) is required with provisioned throughput')
+            efs_file_system.properties['ProvisionedThroughputInMibps'] = float(efs['provisioned_throughput'])
+
+        self.add_resource(efs_file_system)
+
+        efs_mount_targets = []
+        count = 0
+        for i in private_subnets:
+            efs_mount_target = MountTarget(
+                "EFSMountTarget%s" % count,
+                FileSystemId=Ref(efs_file_system),
+                SecurityGroups=[Ref(efs_security_group)],
+                SubnetId=Ref(i)
+            )
+            count += 1
+            efs_mount_targets.append(self.add_resource(efs_mount_target))
+
+        if efs.get('burst_credit_alarm_threshold') is not None:
+            self.add_resource(
+                cloudwatch.Alarm(
+                    'EFSBurstCreditBalanceLow',
+                    MetricName='BurstCreditBalance',
+                    ComparisonOperator='LessThanThreshold',
+                    Period=300,
+                    EvaluationPeriods=1,
+                    Statistic='Minimum',
+                    Namespace='AWS/EFS',
+                    AlarmDescription='EFS burst credits are running out, consider provisioned throughput',
+                    Dimensions=[cloudwatch.MetricDimension(Name='FileSystemId', Value=Ref(efs_file_system))],
+                    Threshold=str(efs['burst_credit_alarm_threshold']),
+                    AlarmActions=efs.get('alarm_actions', [])
+                )
+            )
+
+        return efs_file_system, efs_mount_targets
+
+    def get_efs_mount_user_data(self, efs_file_system, efs, fscache):
+        """
+        Returns the user data lines mounting the file system at the Nextcloud
+        data directory. nconnect is only added on kernels from 5.3, which
+        introduced it
+        @param efs_file_system [FileSystem] file system being mounted
+        @param efs [dict] overrides of DEFAULT_EFS
+        @param fscache [bool] route reads through the local FS-Cache
+        """
+        efs = dict(self.DEFAULT_EFS, **efs)
+        mount_path = efs['mount_path']
+        mount_options = 'nfsvers=4.1,rsize=%d,wsize=%d,hard,timeo=600,retrans=2,noresvport' % (
+            efs['rsize'], efs['wsize'])
+        if fscache:
+            mount_options += ',fsc'
+
+        return [
+            'EFS_OPTIONS=' + mount_options + '\n',
+            'KERNEL_VERSION=$(uname -r | cut -d- -f1)\n',
+            'if [ "$(printf \'%s\\n\' 5.3 "$KERNEL_VERSION" | sort -V | head -n1)" = "5.3" ]; then\n',
+            '    EFS_OPTIONS="$EFS_OPTIONS,nconnect=%d"\n' % efs['nconnect'],
+            'fi\n',
+            'mkdir -p ' + mount_path + '\n',
+            'echo "', Ref(efs_file_system), '.efs.', Ref('AWS::Region'), '.amazonaws.com:/ ',
+            mount_path, ' nfs4 $EFS_OPTIONS,_netdev 0 0" >> /etc/fstab\n',
+            'mount ' + mount_path + '\n',
+            'chown www-data:www-data ' + mount_path + '\n',
+        ]
+
+    def get_fscache_volumes(self, fscache):
+        """
+        Returns the launch configuration's dedicated cache volume, if the
+        fscache config asks for one
+        @param fscache [dict] overrides of DEFAULT_FSCACHE
+        """
+        if fscache is None or not fscache.get('volume_size'):
+            return None
+
+        fscache = dict(self.DEFAULT_FSCACHE, **fscache)
+        return [{
+            'name': self.FSCACHE_VOLUME_DEVICE,
+            'size': str(fscache['volume_size']),
+            'type': fscache['volume_type'],
+            'delete_on_termination': True
+        }]
+
+    def get_fscache_user_data(self, fscache):
+        """
+        Returns the user data lines that prepare the cache directory and run
+        cachefilesd. The cache lives on the dedicated EBS volume, a configured
+        local device such as instance store NVMe, or the root volume
+        @param fscache [dict] overrides of DEFAULT_FSCACHE
+        """
+        if fscache is None:
+            return []
+
+        fscache = dict(self.DEFAULT_FSCACHE, **fscache)
+        cache_dir = fscache['cache_dir']
+        cache_percent = int(fscache['cache_percent'])
+        if not 11 <= cache_percent <= 95:
+            raise ValueError('ec2.fscache.cache_percent must be between 11 and 95')
+
+        # cachefilesd culls below brun/bcull percent free and stops caching
+        # below bstop, which caps the cache at cache_percent of its disk.
+        # brun is bstop + 10 and cachefilesd refuses to start at brun 100%
+        bstop = 100 - cache_percent
+        user_data = ['mkdir -p ' + cache_dir + '\n']
+
+        device = fscache.get('device')
+        if device is None and fscache.get('volume_size'):
+            # Xen instances name the volume xvdf, nitro instances nvme1n1
+            device = '$(ls /dev/nvme1n1 /dev/xvdf 2>/dev/null | head -n1)'
+
+        if device is not None:
+            user_data += [
+                'CACHE_DEVICE=' + device + '\n',
+                '[ -b "$CACHE_DEVICE" ] || { echo "fscache volume not found" >&2; exit 1; }\n',
+                'blkid "$CACHE_DEVICE" || mkfs.ext4 -q "$CACHE_DEVICE"\n',
+                'echo "$CACHE_DEVICE ' + cache_dir + ' ext4 defaults,user_xattr,nofail 0 2" >> /etc/fstab\n',
+                'mount ' + cache_dir + '\n',
+            ]
+
+        return user_data + [
+            'printf \'dir %s\\ntag nextcloud\\nbrun %d%%%%\\nbcull %d%%%%\\nbstop %d%%%%\\n\' ' % (
+                cache_dir, bstop + 10, bstop + 5, bstop) + '> /etc/cachefilesd.conf\n',
+            'sed -i \'s/^#RUN=yes/RUN=yes/\' /etc/default/cachefilesd\n',
+            'systemctl enable cachefilesd\n',
+            'systemctl restart cachefilesd\n',
+        ]
+
+    def get_nextcloud_cache_user_data(self, hosted_zone):
+        """
+        Returns the user data lines pointing Nextcloud's file locking and
+        distributed memcache at the ElastiCache redis cluster, if configured
+        @param hosted_zone [string] Name of the hosted zone the cluster is
+        mapped to
+        """
+        elasticache_config = self.config.get('elasticache')
+        if elasticache_config is None or elasticache_config.get('engine', 'redis') != 'redis':
+            return []
+
+        redis_host = self.elasticache_dns_name(elasticache_config.get('name'), 'redis', hosted_zone).rstrip('.')
+        occ = 'sudo -u www-data php /var/www/nextcloud/occ '
+        return [
+            occ + 'config:system:set redis host --value=' + redis_host + '\n',
+            occ + 'config:system:set redis port --value=6379 --type=integer\n',
+            occ + 'config:system:set memcache.locking --value=\'\\OC\\Memcache\\Redis\'\n',
+            occ + 'config:system:set memcache.distributed --value=\'\\OC\\Memcache\\Redis\'\n',
+            'service apache2 reload\n',
+        ]
+
+    def add_failover_queue(self, name, function, failover):
+        """
+        Queues the failover alarm notifications for the function and returns
+        the topic the alarm notifies. The queue is a standard one, CloudWatch
+        alarms cannot publish to the FIFO topics a FIFO queue needs, so the
+        function orders notifications by their StateChangeTime
+        @param name [string] prefix of the failover resources
+        @param function [Function] failover function draining the queue
+        @param failover [dict] DEFAULT_FAILOVER with the config's overrides
+        """
+        # Six times the function timeout, as Lambda recommends, so a batch
+        # throttled by the reserved concurrency is not delivered twice
+        queue = self.add_sqs_queue(
+            self.env_name + '-failover',
+            message_retention_period=3600,
+            visibility_timeout=6 * failover['timeout']
+        )
+
+        topic = self.add_resource(sns.Topic(
+            name + 'FailoverTopic',
+            Subscription=[sns.Subscription(Endpoint=GetAtt(queue, 'Arn'), Protocol='sqs')]
+        ))
+
+        self.add_resource(sqs.QueuePolicy(
+            name + 'FailoverQueuePolicy',
+            Queues=[Ref(queue)],
+            PolicyDocument={
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Principal': {'Service': 'sns.amazonaws.com'},
+                    'Action': 'sqs:SendMessage',
+                    'Resource': GetAtt(queue, 'Arn'),
+                    'Condition': {'ArnEquals': {'aws:SourceArn': Ref(topic)}}
+                }]
+            }
+        ))
+
+        # troposphere 2.2.1 requires StartingPosition, which queues do not
+        # take, and predates MaximumBatchingWindowInSeconds
+        event_source = awslambda.EventSourceMapping(
+            name + 'FailoverEventSource',
+            validation=False,
+            EventSourceArn=GetAtt(queue, 'Arn'),
+            FunctionName=Ref(function),
+            BatchSize=failover['batch_size'],
+            Enabled=True
+        )
+        event_source.properties['MaximumBatchingWindowInSeconds'] = failover['debounce_seconds']
+        self.add_resource(event_source)
+
+        return topic
+
+    def add_ec2(self, ami_name, instance_type, asg_size, acm_cert, scaling, efs, fscache, cloudfront, failover,
+                cidr, hosted_zone):
         """
         Helper method creates ingress given a source cidr range and a set of
         ports
         @param ami_name [string] Name of the AMI for launching the app
         @param instance_type [string] Instance for the application
         @param asg_size [int] Sets the size of the asg
+        @param scaling [dict] min, max and target settings of the asg scaling
+        policies, see DEFAULT_SCALING
+        @param efs [dict] file system and mount settings, see DEFAULT_EFS
+        @param fscache [dict] local FS-Cache for the EFS mount, see
+        DEFAULT_FSCACHE, disabled when None
+        @param cloudfront [dict] CloudFront in front of the ALB, see
+        DEFAULT_CLOUDFRONT, true for the defaults and None to serve from the
+        ALB directly
+        @param failover [dict] maintenance mode failover, see
+        DEFAULT_FAILOVER, disabled when None
         @param cidr [string] Range of addresses for this vpc
         @param hosted_zone [string] Name of the hosted zone the elb will be
         mapped to
         """
         print "Creating EC2"
 
+        min_size = scaling.get('min', asg_size)
+        max_size = scaling.get('max', self.DEFAULT_SCALING['max'])
+        if int(min_size) > int(max_size):
+            raise ValueError('ec2.scaling min %s is above max %s' % (min_size, max_size))
+
         self.internal_security_group = self.add_sg_with_cidr_port_list(
             "ASGSG",
             "Security Group for EC2",
@@ -102,14 +714,30 @@ class AWSFrederickEC2Template(AWSFrederickCommonTemplate):
             LoadBalancerArn=Ref(public_alb)
         ))
 
-        self.add_elb_dns_alias(public_alb, '', hosted_zone)
+        distribution = None
+        origin_name = (cloudfront.get('origin_name') if isinstance(cloudfront, dict) else None) \
+            or self.DEFAULT_CLOUDFRONT['origin_name']
+        if cloudfront:
+            distribution = self.add_alb_cloudfront(public_alb, acm_cert, cloudfront, hosted_zone)
+        else:
+            self.add_elb_dns_alias(public_alb, '', hosted_zone)
+
+        if failover is not None:
+            # The failover repoints the site record, the health check has to
+            # keep probing the ALB through a name of its own to see it recover
+            if not cloudfront:
+                self.add_elb_dns_alias(public_alb, origin_name, hosted_zone)
+            health_check_host = origin_name + '.' + hosted_zone.rstrip('.')
+            self.add_failover(name, public_alb, distribution, health_check_host, failover, hosted_zone)
+
+        efs_file_system, efs_mount_targets = self.add_efs(private_subnets, efs)
         policies = ['cloudwatchlogs']
         policies_for_profile = [self.get_policy(policy, 'EC2') for policy in policies]
 
         asg = self.add_asg(
             "EC2",
-            min_size=asg_size,
-            max_size=6,
+            min_size=min_size,
+            max_size=max_size,
             ami_name=ami_name,
             # load_balancer=public_elb,
             instance_profile=self.add_instance_profile(name, policies_for_profile, name),
@@ -125,73 +753,19 @@ class AWSFrederickEC2Template(AWSFrederickCommonTemplate):
                     MaxBatchSize='1'
                 )
             ),
+            ebs_data_volumes=self.get_fscache_volumes(fscache),
+            # Instances mount the file system on boot
+            depends_on=[mount_target.title for mount_target in efs_mount_targets],
             user_data=Base64(Join('', [
                 '#!/bin/bash\n',
                 'echo Good to go\n',
-            ])))
+            ] + self.get_fscache_user_data(fscache)
+              + self.get_efs_mount_user_data(efs_file_system, efs, fscache is not None)
+              + self.get_nextcloud_cache_user_data(hosted_zone))))
 
         asg.resource['Properties']['TargetGroupARNs'] = [Ref(target_group)]
 
-        # Cluster Memory Scaling policies
-        asg_scale_up_policy = self.add_resource(
-            autoscaling.ScalingPolicy(
-                name + 'ScaleUpPolicy',
-                AdjustmentType='ChangeInCapacity',
-                AutoScalingGroupName=Ref(asg),
-                Cooldown=300,
-                ScalingAdjustment=1
-            )
-        )
-
-        # ELB latency above a threshold
-        self.add_resource(
-            cloudwatch.Alarm(
-                name + 'LatencyHigh',
-                MetricName='Latency',
-                ComparisonOperator='GreaterThanThreshold',
-                Period=300,
-                EvaluationPeriods=1,
-                Statistic='Average',
-                Namespace='AWS/ELB',
-                AlarmDescription=name + 'LatencyHigh',
-                Dimensions=[cloudwatch.MetricDimension(Name='LoadBalancerName', Value=Ref(public_alb))],
-                Threshold='6',
-                AlarmActions=[
-                  Ref(asg_scale_up_policy),
-                  'arn:aws:sns:us-east-1:422548007577:notify-pat'
-                ]
-            )
-        )
-
-        efs_security_group_rule = SecurityGroupRule(
-            IpProtocol='tcp',
-            FromPort='2049',
-            ToPort='2049',
-            SourceSecurityGroupId=Ref(self.internal_security_group)
-        )
-
-        efs_security_group = SecurityGroup(
-            "SecurityGroup",
-            SecurityGroupIngress=[efs_security_group_rule],
-            VpcId=Ref('vpcId'),
-            GroupDescription="Allow NFS over TCP"
-        )
-        self.add_resource(efs_security_group)
-
-        tags = Tags(Name='EFSFileSystem')
-        efs_file_system = FileSystem(
-            "EFSFileSystem",
-            FileSystemTags=tags
-        )
-        self.add_resource(efs_file_system)
-
-        count = 0
-        for i in private_subnets:
-            efs_mount_target = MountTarget(
-                "EFSMountTarget%s" % count,
-                FileSystemId=Ref(efs_file_system),
-                SecurityGroups=[Ref(efs_security_group)],
-                SubnetId=Ref(i)
-            )
-            count += 1
-            self.add_resource(efs_mount_target)
\ No newline at end of file
+        # The scaling policies own the group's size, leaving DesiredCapacity
+        # out keeps stack updates from resetting it to the minimum
+        asg.resource['Properties'].pop('DesiredCapacity', None)
+        self.add_asg_scaling_policies(name, asg, public_alb, target_group, alb_ssl_listener, scaling)
@@ -1,18 +1,128 @@
 from aws_frederick_common import AWSFrederickCommonTemplate
-from troposphere import Ref, GetAtt, Base64, Join, Output, Template
+from troposphere import AWSObject, Ref, GetAtt, Base64, Join, Output, Template
 from troposphere.policies import UpdatePolicy, AutoScalingRollingUpdate
 from troposphere import ecs
 import troposphere.elasticloadbalancing as elb
+import troposphere.elasticloadbalancingv2 as alb
 import troposphere.constants as tpc
 import troposphere.autoscaling as autoscaling
 import troposphere.cloudwatch as cloudwatch
 
 
+class AWSFrederickECSCapacityProvider(AWSObject):
+    """
+    AWS::ECS::CapacityProvider, troposphere 2.2.1 predates capacity providers
+    """
+    resource_type = "AWS::ECS::CapacityProvider"
+
+    props = {
+        'AutoScalingGroupProvider': (dict, True),
+        'Name': (basestring, False)
+    }
+
+
+class AWSFrederickECSClusterCapacityProviderAssociations(AWSObject):
+    """
+    AWS::ECS::ClusterCapacityProviderAssociations, troposphere 2.2.1
+    predates capacity providers
+    """
+    resource_type = "AWS::ECS::ClusterCapacityProviderAssociations"
+
+    props = {
+        'CapacityProviders': (list, True),
+        'Cluster': (basestring, True),
+        'DefaultCapacityProviderStrategy': (list, True)
+    }
+
+
 class AWSFrederickECSTemplate(AWSFrederickCommonTemplate):
     """
     Enhances basic template by providing AWS Frederick ECS resources
     """
 
+    # Scaling settings of an ecs entry used when it leaves them out. A target
+    # tracking policy is created for every *_target that is set, cpu and
+    # memory in percent of the task size, request_count in requests per task
+    # per minute. Cooldowns are in seconds
+    DEFAULT_SCALING = {
+        'min': 1,
+        'max': 1,
+        'scale_in_cooldown': 300,
+        'scale_out_cooldown': 60
+    }
+
+    # ecs.alb settings used when the config leaves them out. The health
+    # check and deregistration_delay keys can also be set per ecs entry.
+    # Intervals, timeouts and delays are in seconds
+    DEFAULT_ALB = {
+        'health_check_path': '/',
+        'health_check_interval': 30,
+        'health_check_timeout': 5,
+        'healthy_threshold': 3,
+        'unhealthy_threshold': 3,
+        'health_check_matcher': '200-399',
+        'health_check_grace_period': 60,
+        'deregistration_delay': 30,
+        'idle_timeout': 60
+    }
+
+    # ecs.discovery settings used when the config leaves them out. Entries
+    # with discovery set register their tasks as <name>.<namespace>.<hosted
+    # zone> in a Cloud Map namespace private to the vpc, ttl in seconds
+    DEFAULT_DISCOVERY = {
+        'namespace': 'internal',
+        'record_types': ['A', 'SRV'],
+        'ttl': 10,
+        'failure_threshold': 1
+    }
+
+    # Name of the cluster when the config does not set ecs.cluster
+    DEFAULT_CLUSTER = 'filesharefrederick'
+
+    # Capacity providers ecs.capacity_providers and the capacity_providers
+    # of an entry may weight, e.g. {FARGATE: {base: 1}, FARGATE_SPOT: 3}.
+    # Services without a strategy are launched on FARGATE
+    FARGATE_CAPACITY_PROVIDERS = ['FARGATE', 'FARGATE_SPOT']
+
+    # Name the EC2 capacity provider of ecs.capacity: ec2 goes by in a
+    # strategy. A strategy cannot mix it with the Fargate providers
+    EC2_CAPACITY_PROVIDER = 'EC2'
+
+    # ecs.ec2 settings used when ecs.capacity is ec2. The instances run the
+    # ECS optimized AMI from ami_parameter unless ami_id names a RegionMap
+    # entry. Managed scaling keeps the reserved share of the group at
+    # target_capacity percent, instance_warmup is in seconds
+    DEFAULT_EC2_CAPACITY = {
+        'instance_type': 'm5.large',
+        'min': 1,
+        'max': 4,
+        'root_volume_size': 30,
+        'ami_id': None,
+        'ami_parameter': '/aws/service/ecs/optimized-ami/amazon-linux-2/recommended/image_id',
+        'target_capacity': 100,
+        'minimum_scaling_step_size': 1,
+        'maximum_scaling_step_size': 2,
+        'instance_warmup': 300
+    }
+
+    # PlacementStrategies per placement of an ecs entry on EC2 capacity.
+    # binpack fills the instance with the least memory left first, spread
+    # balances tasks across zones and then instances
+    PLACEMENT_STRATEGIES = {
+        'binpack': [('binpack', 'memory')],
+        'spread': [('spread', 'attribute:ecs.availability-zone'), ('spread', 'instanceId')]
+    }
+
+    # Placement of an ecs entry on EC2 capacity that does not set one
+    DEFAULT_PLACEMENT = 'binpack'
+
+    # Policy name suffix and predefined metric per scaling target setting
+    SCALING_METRICS = {
+        'cpu_target': ('CPU', 'ECSServiceAverageCPUUtilization'),
+        'memory_target': ('Memory', 'ECSServiceAverageMemoryUtilization'),
+        'request_count_target': ('RequestCount', 'ALBRequestCountPerTarget')
+    }
+
     # Collect all the values we need to assemble our SuperBowlOnARoll stack
     def __init__(self, env_name, region, cidr_range, aws_frederick_config):
         super(AWSFrederickECSTemplate, self).__init__('AWSFrederickECS')
@@ -21,29 +131,437 @@ class AWSFrederickECSTemplate(AWSFrederickCommonTemplate):
         self.region = region
         self.cidr_range = cidr_range
         self.config = aws_frederick_config
+        self.scaling_role = None
+        self.alb = None
+        self.alb_listeners = {}
+        self.alb_aliases = set()
+        self.ec2_capacity_provider = None
+        self.capacity_provider_associations = None
+        self.namespace = None
+
+    @staticmethod
+    def get_ecs_config(ecs_config):
+        """
+        Returns the ecs section as {cluster, alb, services}, a plain list of
+        services is the cluster's services with the default alb settings
+        """
+        if isinstance(ecs_config, list):
+            ecs_config = {'services': ecs_config}
+        return dict({'cluster': AWSFrederickECSTemplate.DEFAULT_CLUSTER, 'capacity': 'fargate', 'alb': {},
+                     'discovery': {}, 'services': []},
+                    **dict((key, value) for key, value in ecs_config.items() if value is not None))
 
     def build_hook(self):
         print "Building Template for AWS Frederick ECS"
 
         hosted_zone_name = self.config.get('hosted_zone')
-        ecs_config = self.config.get('ecs')
-        if ecs_config is not None:
-            cluster = self.add_resource(ecs.Cluster('filesharefrederick',
-                                                    ClusterName='filesharefrederick'))
-            for ecs in ecs_config:
+        if self.config.get('ecs') is not None:
+            ecs_config = self.get_ecs_config(self.config.get('ecs'))
+            services = ecs_config['services']
+            cluster_name = ecs_config['cluster']
+            self.cluster = self.add_resource(ecs.Cluster(cluster_name.replace('-', '').replace('_', ''),
+                                                         ClusterName=cluster_name))
+
+            private_subnet_count = len(self._subnets.get('private').get('private'))
+            self.private_subnets = [Ref("privateAZ%d" % n) for n in range(0, private_subnet_count)]
+
+            # Fargate tasks get their own interface in this group, open to the
+            # vpc on every container port
+            container_ports = sorted(set(int(service.get('container_port') or 80) for service in services))
+            self.internal_security_group = self.add_sg_with_cidr_port_list(
+                "ASGSG",
+                "Security Group for ECS",
+                'vpcId',
+                self.cidr_range,
+                [{str(port): str(port)} for port in container_ports]
+            )
+
+            if ecs_config['capacity'] not in ['fargate', 'ec2']:
+                raise ValueError('Unknown ecs.capacity %s, expected fargate or ec2' % ecs_config['capacity'])
+            capacity_providers = ecs_config.get('capacity_providers')
+            if ecs_config['capacity'] == 'ec2':
+                self.add_ecs_ec2_capacity(cluster_name, dict(self.DEFAULT_EC2_CAPACITY, **ecs_config.get('ec2', {})))
+                capacity_providers = capacity_providers or {self.EC2_CAPACITY_PROVIDER: 1}
+
+            # A separate association instead of the cluster's own properties
+            # lets the cluster and the providers be deleted or replaced
+            # independently of each other
+            if capacity_providers or any(service.get('capacity_providers') for service in services):
+                self.capacity_provider_associations = self.add_resource(
+                    AWSFrederickECSClusterCapacityProviderAssociations(
+                        'ECSCapacityProviderAssociations',
+                        Cluster=Ref(self.cluster),
+                        CapacityProviders=self.FARGATE_CAPACITY_PROVIDERS + (
+                            [Ref(self.ec2_capacity_provider)] if self.ec2_capacity_provider is not None else []),
+                        DefaultCapacityProviderStrategy=self.get_capacity_provider_strategy(capacity_providers or {})
+                    ))
+
+            alb_ports = sorted(set(int(service['alb_port']) for service in services if service.get('alb_port')))
+            self.public_lb_security_group = self.add_sg_with_cidr_port_list(
+                "ELBSG",
+                "Security Group for accessing ECS publicly",
+                'vpcId',
+                '0.0.0.0/0',
+                [{str(port): str(port)} for port in alb_ports] or [{"443": "443"}]
+            )
+
+            discovery_config = dict(self.DEFAULT_DISCOVERY, **ecs_config['discovery'])
+            if any(service.get('discovery') for service in services):
+                self.namespace = self.add_private_dns_namespace(
+                    'ECSNamespace',
+                    discovery_config['namespace'] + '.' + hosted_zone_name.rstrip('.')
+                )
+
+            alb_config = dict(self.DEFAULT_ALB, **ecs_config['alb'])
+            if alb_ports:
+                self.add_ecs_alb(alb_config, hosted_zone_name)
+
+            priorities = self.get_alb_rule_priorities(services)
+            for service in services:
+                routing = dict(alb_config, priority=priorities.get(service.get('name')))
+                routing.update((key, service[key]) for key in self.DEFAULT_ALB.keys() + ['host', 'path']
+                               if service.get(key) is not None)
+
+                discovery = service.get('discovery')
+                if discovery:
+                    discovery = dict(discovery_config, **(discovery if isinstance(discovery, dict) else {}))
+
                 self.add_ecs(
-                    ecs.get('name'),
-                    ecs.get('image'),
-                    ecs.get('cpu'),
-                    ecs.get('memory'),
-                    ecs.get('container_port'),
-                    ecs.get('alb_port'),
-                    ecs.get('envvars'),
+                    service.get('name'),
+                    service.get('image'),
+                    service.get('cpu'),
+                    service.get('memory'),
+                    service.get('container_port'),
+                    service.get('alb_port'),
+                    service.get('envvars'),
+                    service.get('scaling'),
+                    routing,
+                    service.get('capacity_providers') or capacity_providers,
+                    service.get('placement'),
+                    discovery or None,
                     self.cidr_range,
                     hosted_zone_name
                 )
 
-    def add_ecs(self, name, image, cpu, memory, container_port, alb_port, envvars, cidr, hosted_zone):
+    def add_ecs_ec2_capacity(self, cluster_name, capacity):
+        """
+        Creates an auto scaling group of ECS optimized instances joining the
+        cluster and the capacity provider scaling it. Instances running tasks
+        are protected from scale in and drained before they are terminated
+        @param cluster_name [string] Name of the cluster the instances join
+        @param capacity [dict] DEFAULT_EC2_CAPACITY with the ecs.ec2 overrides
+        """
+        print "Creating ECS EC2 capacity: %s" % capacity['instance_type']
+
+        policies = [self.get_policy(policy, 'ECSCapacity') for policy in ['ecs', 'ecr', 'cloudwatchlogs']]
+        asg = self.add_asg(
+            'ECSCapacity',
+            min_size=capacity['min'],
+            max_size=capacity['max'],
+            ami_name=capacity['ami_id'] or 'amazonLinuxAmiId',
+            instance_profile=self.add_instance_profile_ecs('ECSCapacity', policies, 'ECSCapacity'),
+            instance_type=capacity['instance_type'],
+            security_groups=['commonSecurityGroup', Ref(self.internal_security_group)],
+            subnet_layer='private',
+            root_volume_size=capacity['root_volume_size'],
+            root_volume_type='gp2',
+            include_ephemerals=False,
+            user_data=Base64(Join('', [
+                '#!/bin/bash\n',
+                'echo ECS_CLUSTER=%s >> /etc/ecs/ecs.config\n' % cluster_name,
+                'echo ECS_ENABLE_CONTAINER_METADATA=true >> /etc/ecs/ecs.config\n'
+            ])))
+
+        launch_config = self.resources['ECSCapacityLaunchConfiguration']
+        if capacity['ami_id'] is None:
+            launch_config.ImageId = '{{resolve:ssm:%s}}' % capacity['ami_parameter']
+        # The ECS optimized AMIs boot from /dev/xvda
+        launch_config.BlockDeviceMappings[0].DeviceName = '/dev/xvda'
+
+        # Managed scaling owns the group's size, managed termination
+        # protection needs every new instance protected from scale in
+        asg.properties.pop('DesiredCapacity', None)
+        asg.properties['NewInstancesProtectedFromScaleIn'] = True
+
+        self.ec2_capacity_provider = self.add_resource(AWSFrederickECSCapacityProvider(
+            'ECSCapacityProvider',
+            AutoScalingGroupProvider={
+                'AutoScalingGroupArn': Ref(asg),
+                'ManagedScaling': {
+                    'Status': 'ENABLED',
+                    'TargetCapacity': int(capacity['target_capacity']),
+                    'MinimumScalingStepSize': int(capacity['minimum_scaling_step_size']),
+                    'MaximumScalingStepSize': int(capacity['maximum_scaling_step_size']),
+                    'InstanceWarmupPeriod': int(capacity['instance_warmup'])
+                },
+                'ManagedTerminationProtection': 'ENABLED',
+                'ManagedDraining': 'ENABLED'
+            }
+        ))
+        return self.ec2_capacity_provider
+
+    def get_capacity_provider_strategy(self, capacity_providers):
+        """
+        Returns the CapacityProviderStrategy items for a map of capacity
+        provider to its weight or to {weight, base}
+        @param capacity_providers [dict] strategy from the config
+        """
+        known_providers = self.FARGATE_CAPACITY_PROVIDERS + (
+            [self.EC2_CAPACITY_PROVIDER] if self.ec2_capacity_provider is not None else [])
+        if self.EC2_CAPACITY_PROVIDER in capacity_providers and len(capacity_providers) > 1:
+            raise ValueError('The %s capacity provider cannot be mixed with %s' % (
+                self.EC2_CAPACITY_PROVIDER, ', '.join(self.FARGATE_CAPACITY_PROVIDERS)))
+
+        strategy = []
+        for provider, settings in sorted(capacity_providers.items()):
+            if provider not in known_providers:
+                raise ValueError('Unknown capacity provider %s, expected one of %s' % (
+                    provider, ', '.join(known_providers)))
+            if not isinstance(settings, dict):
+                settings = {'weight': settings}
+
+            item = {
+                'CapacityProvider': Ref(self.ec2_capacity_provider)
+                if provider == self.EC2_CAPACITY_PROVIDER else provider,
+                'Weight': int(settings.get('weight', 1))
+            }
+            if settings.get('base'):
+                item['Base'] = int(settings['base'])
+            strategy.append(item)
+
+        if len([item for item in strategy if item.get('Base')]) > 1:
+            raise ValueError('Only one capacity provider of a strategy can have a base')
+        return strategy
+
+    @staticmethod
+    def get_alb_rule_priorities(services):
+        """
+        Returns the listener rule priority per name of the services with an
+        alb_port. Services without a priority get the lowest ones no service
+        sets, in the order they are listed
+        @param services [list] ecs entries
+        """
+        routed = [service for service in services if service.get('alb_port')]
+        taken = set(int(service['priority']) for service in routed if service.get('priority') is not None)
+
+        priorities = {}
+        rules = {}
+        next_priority = 1
+        for service in routed:
+            if service.get('priority') is not None:
+                priority = int(service['priority'])
+            else:
+                while next_priority in taken:
+                    next_priority += 1
+                priority = next_priority
+                taken.add(priority)
+
+            rule = (int(service['alb_port']), priority)
+            if rule in rules:
+                raise ValueError('ecs services %s and %s both use priority %d on alb_port %d' % (
+                    rules[rule], service.get('name'), priority, rule[0]))
+            rules[rule] = service.get('name')
+            priorities[service.get('name')] = priority
+        return priorities
+
+    def add_ecs_alb(self, alb_config, hosted_zone):
+        """
+        Creates the load balancer every ecs service with an alb_port is
+        routed through, its listeners are added with the first service on
+        their port
+        @param alb_config [dict] DEFAULT_ALB with the ecs.alb overrides, name
+        adds an alias for the load balancer itself in the hosted zone
+        @param hosted_zone [string] Name of the hosted zone
+        """
+        public_subnet_count = len(self._subnets.get('public').get('public'))
+        self.alb = self.add_resource(alb.LoadBalancer(
+            "ECSPublicALB",
+            Scheme='internet-facing',
+            Subnets=[Ref("publicAZ%d" % n) for n in range(0, public_subnet_count)],
+            SecurityGroups=[Ref(self.public_lb_security_group)],
+            LoadBalancerAttributes=[alb.LoadBalancerAttributes(
+                Key='idle_timeout.timeout_seconds',
+                Value=str(alb_config['idle_timeout'])
+            )]
+        ))
+
+        if alb_config.get('name'):
+            self.add_ecs_alb_alias(alb_config['name'], hosted_zone)
+        return self.alb
+
+    def add_ecs_alb_alias(self, host, hosted_zone):
+        """
+        Points <host>.<hosted zone> at the load balancer, once per host
+        """
+        if host.lower() not in self.alb_aliases:
+            self.alb_aliases.add(host.lower())
+            self.add_elb_dns_alias(self.alb, host, hosted_zone)
+
+    def add_ecs_alb_listener(self, port, target_group, alb_config):
+        """
+        Returns the listener on port, creating it with target_group as the
+        default action for requests no rule matches. 443 is served over
+        HTTPS with the ecs.alb certificate
+        """
+        if port in self.alb_listeners:
+            return self.alb_listeners[port]
+
+        listener = alb.Listener(
+            "ECSListener%d" % port,
+            Port=port,
+            Protocol='HTTP',
+            DefaultActions=[alb.Action(Type='forward', TargetGroupArn=Ref(target_group))],
+            LoadBalancerArn=Ref(self.alb)
+        )
+        if port == 443:
+            if not alb_config.get('certificate'):
+                raise ValueError('ecs.alb needs a certificate for services on alb_port 443')
+            listener.Protocol = 'HTTPS'
+            listener.Certificates = [alb.Certificate(CertificateArn=alb_config['certificate'])]
+
+        self.alb_listeners[port] = self.add_resource(listener)
+        return self.alb_listeners[port]
+
+    def add_ecs_alb_route(self, name, container_port, alb_port, routing, hosted_zone):
+        """
+        Creates the service's target group and the listener rule forwarding
+        its host and path to it. Without host or path the service is
+        reached as <name>.<hosted zone>. Returns (target group, rule)
+        @param name [string] Name of the service
+        @param container_port [int] port the container listens on
+        @param alb_port [int] listener port the service is reached on
+        @param routing [dict] host, path, priority, health check and
+        deregistration_delay of the service
+        @param hosted_zone [string] Name of the hosted zone
+        """
+        target_group = self.add_resource(alb.TargetGroup(
+            name + 'TargetGroup',
+            Port=int(container_port),
+            Protocol='HTTP',
+            TargetType='ip',
+            VpcId=self.vpc_id,
+            HealthCheckPath=routing['health_check_path'],
+            HealthCheckIntervalSeconds=routing['health_check_interval'],
+            HealthCheckTimeoutSeconds=routing['health_check_timeout'],
+            HealthyThresholdCount=routing['healthy_threshold'],
+            UnhealthyThresholdCount=routing['unhealthy_threshold'],
+            Matcher=alb.Matcher(HttpCode=str(routing['health_check_matcher'])),
+            TargetGroupAttributes=[alb.TargetGroupAttribute(
+                Key='deregistration_delay.timeout_seconds',
+                Value=str(routing['deregistration_delay'])
+            )]
+        ))
+
+        listener = self.add_ecs_alb_listener(int(alb_port), target_group, routing)
+
+        host = routing.get('host')
+        if host is None and routing.get('path') is None:
+            host = name
+        conditions = []
+        if host is not None:
+            self.add_ecs_alb_alias(host, hosted_zone)
+            conditions.append(alb.Condition(Field='host-header', Values=[host.lower() + '.' + hosted_zone.rstrip('.')]))
+        if routing.get('path') is not None:
+            conditions.append(alb.Condition(Field='path-pattern', Values=[routing['path']]))
+
+        rule = self.add_resource(alb.ListenerRule(
+            name + 'ListenerRule',
+            ListenerArn=Ref(listener),
+            Priority=int(routing['priority']),
+            Conditions=conditions,
+            Actions=[alb.Action(Type='forward', TargetGroupArn=Ref(target_group))]
+        ))
+        return target_group, rule
+
+    def add_ecs_discovery(self, name, service, container_port, discovery):
+        """
+        Registers the service's tasks in the Cloud Map namespace, so calls
+        from inside the vpc reach them directly instead of through the ALB.
+        SRV records carry the container port
+        @param name [string] Name of the service
+        @param service [Service] service whose tasks are registered
+        @param container_port [int] port the container listens on
+        @param discovery [dict] DEFAULT_DISCOVERY with the overrides
+        """
+        registry = self.add_discovery_service(
+            name,
+            self.namespace,
+            discovery['record_types'],
+            discovery['ttl'],
+            failure_threshold=discovery['failure_threshold']
+        )
+
+        entry = {'RegistryArn': GetAtt(registry, 'Arn')}
+        if 'SRV' in discovery['record_types']:
+            if not container_port:
+                raise ValueError('ecs service %s: SRV records need a container_port' % name)
+            entry['ContainerName'] = name
+            entry['ContainerPort'] = int(container_port)
+
+        # troposphere 2.2.1 predates service registries
+        service.properties['ServiceRegistries'] = [entry]
+        return registry
+
+    def get_scaling_role(self):
+        """
+        Returns the role Application Auto Scaling uses for every service,
+        created with the first service that scales
+        """
+        if self.scaling_role is None:
+            self.scaling_role = self.add_role(
+                'ECSServiceScaling',
+                ['application-autoscaling.amazonaws.com'],
+                ['autoscaling_ecs']
+            )
+        return self.scaling_role
+
+    def add_ecs_scaling_policies(self, name, service, scaling, resource_label=None, depends_on=None):
+        """
+        Registers the service with Application Auto Scaling and adds a target
+        tracking policy per configured target
+        @param name [string] Name of the service
+        @param service [Service] service being scaled
+        @param scaling [dict] overrides of DEFAULT_SCALING
+        @param resource_label [string] load balancer and target group of the
+        service, needed for request_count_target
+        @param depends_on [string] resource attaching the target group to the
+        load balancer, the request count metric only exists after it
+        """
+        scaling = dict(self.DEFAULT_SCALING, **scaling)
+        if int(scaling['min']) > int(scaling['max']):
+            raise ValueError('ecs service %s: scaling min %s is above max %s' % (name, scaling['min'], scaling['max']))
+
+        scalable_target = self.add_ecs_scalable_target(
+            name + 'ScalableTarget',
+            self.cluster,
+            service,
+            scaling['min'],
+            scaling['max'],
+            self.get_scaling_role()
+        )
+
+        for key, (label, metric_type) in sorted(self.SCALING_METRICS.items()):
+            if scaling.get(key) is None:
+                continue
+            if metric_type == 'ALBRequestCountPerTarget' and resource_label is None:
+                raise ValueError('ecs service %s: request_count_target needs the service behind the ALB' % name)
+
+            policy = self.add_service_target_tracking_policy(
+                name + label + 'ScalingPolicy',
+                scalable_target,
+                metric_type,
+                scaling[key],
+                scale_in_cooldown=scaling['scale_in_cooldown'],
+                scale_out_cooldown=scaling['scale_out_cooldown'],
+                resource_label=resource_label if metric_type == 'ALBRequestCountPerTarget' else None
+            )
+            if metric_type == 'ALBRequestCountPerTarget' and depends_on is not None:
+                policy.DependsOn = depends_on
+
+        return scalable_target
+
+    def add_ecs(self, name, image, cpu, memory, container_port, alb_port, envvars, scaling, routing,
+                capacity_providers, placement, discovery, cidr, hosted_zone):
         """
         Helper method creates ingress given a source cidr range and a set of
         ports
@@ -51,27 +569,31 @@ class AWSFrederickECSTemplate(AWSFrederickCommonTemplate):
         @param image [string] Docker image name
         @param memory [int] Sets the memory size of the service
         @param envvars [list] List of envvars
+        @param scaling [dict] min, max and target tracking settings, see
+        DEFAULT_SCALING, a single task when None
+        @param routing [dict] host, path, rule priority, health check and
+        deregistration delay on the shared ALB, see DEFAULT_ALB
+        @param capacity_providers [dict] weight and base per capacity
+        provider, launched on FARGATE when None
+        @param placement [string] binpack or spread, see PLACEMENT_STRATEGIES,
+        only for services on the EC2 capacity provider
+        @param discovery [dict] record types, ttl and failure threshold of
+        the service in the Cloud Map namespace, see DEFAULT_DISCOVERY, not
+        registered when None
         @param cidr [string] Range of addresses for this vpc
         @param hosted_zone [string] Name of the hosted zone the elb will be
         mapped to
         """
         print "Creating ECS"
 
-        self.internal_security_group = self.add_sg_with_cidr_port_list(
-            "ASGSG",
-            "Security Group for ECS",
-            'vpcId',
-            cidr,
-            [{"80": "80"}]
-        )
-
-        self.public_lb_security_group = self.add_sg_with_cidr_port_list(
-            "ELBSG",
-            "Security Group for accessing ECS publicly",
-            'vpcId',
-            '0.0.0.0/0',
-            [{"443": "443"}]
-        )
+        on_ec2 = self.EC2_CAPACITY_PROVIDER in (capacity_providers or {})
+        if placement is not None and not on_ec2:
+            raise ValueError('ecs service %s: placement needs the %s capacity provider' % (
+                name, self.EC2_CAPACITY_PROVIDER))
+        placement = placement or self.DEFAULT_PLACEMENT
+        if placement not in self.PLACEMENT_STRATEGIES:
+            raise ValueError('ecs service %s: unknown placement %s, expected one of %s' % (
+                name, placement, ', '.join(sorted(self.PLACEMENT_STRATEGIES))))
 
         container_def = ecs.ContainerDefinition(name + 'containerdef',
                                                 Name=name,
@@ -85,12 +607,66 @@ class AWSFrederickECSTemplate(AWSFrederickCommonTemplate):
         task_def = self.add_resource(ecs.TaskDefinition(name + 'taskdef',
                                      Cpu=cpu,
                                      Memory=memory,
-                                     RequiresCompatibilities=['FARGATE'],
+                                     RequiresCompatibilities=['EC2' if on_ec2 else 'FARGATE'],
                                      NetworkMode='awsvpc',
                                      ContainerDefinitions=[container_def]))
 
-        self.add_resource(ecs.Service(name + 'service',
-                                      Cluster=Ref(cluster),
-                                      LaunchType='FARGATE',
-                                      TaskDefinition=Ref(task_def),
-                                      DesiredCount=1))
+        # awsvpc tasks need subnets and security groups of their own
+        service = ecs.Service(name + 'service',
+                              Cluster=Ref(self.cluster),
+                              LaunchType='FARGATE',
+                              TaskDefinition=Ref(task_def),
+                              NetworkConfiguration=ecs.NetworkConfiguration(
+                                  AwsvpcConfiguration=ecs.AwsvpcConfiguration(
+                                      AssignPublicIp='DISABLED',
+                                      SecurityGroups=[Ref(self.internal_security_group)],
+                                      Subnets=self.private_subnets
+                                  )
+                              ))
+
+        resource_label = None
+        rule = None
+        depends_on = []
+        if alb_port:
+            target_group, rule = self.add_ecs_alb_route(name, container_port, alb_port, routing, hosted_zone)
+            service.LoadBalancers = [ecs.LoadBalancer(
+                ContainerName=name,
+                ContainerPort=int(container_port),
+                TargetGroupArn=Ref(target_group)
+            )]
+            service.HealthCheckGracePeriodSeconds = routing['health_check_grace_period']
+            # The target group must be attached to the load balancer first
+            depends_on.append(rule.title)
+            resource_label = Join('/', [
+                GetAtt(self.alb, 'LoadBalancerFullName'),
+                GetAtt(target_group, 'TargetGroupFullName')
+            ])
+        # A strategy replaces the launch type, the base tasks are placed
+        # first and the rest are split by weight
+        if capacity_providers:
+            service.properties.pop('LaunchType')
+            service.properties['CapacityProviderStrategy'] = self.get_capacity_provider_strategy(capacity_providers)
+            depends_on.append(self.capacity_provider_associations.title)
+        if depends_on:
+            service.DependsOn = depends_on
+        if on_ec2:
+            service.PlacementStrategies = [ecs.PlacementStrategy(Type=strategy_type, Field=field)
+                                           for strategy_type, field in self.PLACEMENT_STRATEGIES[placement]]
+        # The scaling policies own the count of a scaled service, leaving
+        # DesiredCount out keeps stack updates from resetting it to min
+        if scaling is None:
+            service.DesiredCount = 1
+        if discovery is not None:
+            self.add_ecs_discovery(name, service, container_port, discovery)
+        self.add_resource(service)
+
+        if scaling is not None:
+            self.add_ecs_scaling_policies(
+                name,
+                service,
+                scaling,
+                resource_label=resource_label,
+                depends_on=rule.title if rule is not None else None
+            )
+
+        return service
@@ -0,0 +1,69 @@
+from aws_frederick_common import AWSFrederickCommonTemplate
+
+
+class AWSFrederickElastiCacheTemplate(AWSFrederickCommonTemplate):
+    """
+    Enhances basic template by providing AWS Frederick ElastiCache resources
+    """
+
+    # Ports the cache engines listen on
+    ENGINE_PORTS = {
+        'redis': 6379,
+        'memcached': 11211
+    }
+
+    # Collect all the values we need to assemble our ElastiCache stack
+    def __init__(self, env_name, region, cidr_range, aws_frederick_config):
+        super(AWSFrederickElastiCacheTemplate, self).__init__(env_name + 'ElastiCache')
+
+        self.env_name = env_name
+        self.region = region
+        self.cidr_range = cidr_range
+        self.config = aws_frederick_config
+
+    def build_hook(self):
+        print "Building Template for %s ElastiCache" % self.env_name
+
+        hosted_zone_name = self.config.get('hosted_zone')
+        elasticache_config = self.config.get('elasticache')
+        if elasticache_config is not None:
+            self.add_elasticache(
+                elasticache_config.get('name'),
+                elasticache_config.get('engine', 'redis'),
+                elasticache_config.get('cache_node_type'),
+                elasticache_config.get('num_nodes', 1),
+                self.cidr_range,
+                hosted_zone_name
+            )
+
+    def add_elasticache(self, name, engine, cache_node_type, num_nodes, cidr, hosted_zone):
+        """
+        Helper method creates a cache cluster in the private subnets,
+        reachable from the vpc and aliased in the hosted zone
+        @param name [string] Name of the cache cluster
+        @param engine [string] redis or memcached
+        @param cache_node_type [string] Instance type of the cache nodes
+        @param num_nodes [int] Number of cache nodes, redis clusters take 1
+        @param cidr [string] Range of addresses for this vpc
+        @param hosted_zone [string] Name of the hosted zone the cluster will be
+        mapped to
+        """
+        print "Creating ElastiCache: %s %s" % (name, engine)
+
+        private_subnets = [{"Ref": "privateAZ0"}, {"Ref": "privateAZ1"}, {"Ref": "privateAZ2"}]
+        port = self.ENGINE_PORTS[engine]
+
+        cache_security_group = self.add_simple_sg_with_cidr(
+            name + engine + 'SecurityGroup',
+            'ElastiCache security group for ' + name + engine,
+            'vpcId',
+            cidr,
+            port,
+            port,
+            'tcp'
+        )
+
+        subnet_group = self.add_elasticache_subnet_group(name, engine, private_subnets)
+        cluster = self.add_cachecluster(cache_node_type, cache_security_group, name, engine, num_nodes, subnet_group)
+
+        self.add_elasticache_dns_alias(cluster, name, engine, hosted_zone)
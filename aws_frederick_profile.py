@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+import threading
+import resource
+import json
+import time
+
+
+class AWSFrederickProfiler(object):
+    """
+    Per phase and per template timing of a create or deploy run. Disabled
+    unless --profile is given, callers on hot paths check enabled before
+    entering a phase
+    """
+
+    # Label for phases that do not belong to a child template
+    ENVIRONMENT = '(environment)'
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self._order = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    @staticmethod
+    def peak_rss_kb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextmanager
+    def phase(self, name, template=None):
+        """
+        Times the enclosed block and records it under (name, template).
+        Allocation is measured as growth of the process peak RSS, so it is
+        only attributed to the phase that first reaches a new peak
+        @param name [string] phase name, e.g. build_hook or upload
+        @param template [string] name of the template the phase works on
+        """
+        start = time.time()
+        start_rss = self.peak_rss_kb()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.record(name, template, time.time() - start, self.peak_rss_kb() - start_rss)
+
+    def record(self, name, template, seconds, rss_growth_kb):
+        key = (name, template or self.ENVIRONMENT)
+        with self._lock:
+            if key not in self.phases:
+                self._order.append(key)
+                self.phases[key] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rss_growth_kb': 0}
+
+            phase = self.phases[key]
+            phase['calls'] += 1
+            phase['seconds'] += seconds
+            phase['max_seconds'] = max(phase['max_seconds'], seconds)
+            phase['rss_growth_kb'] += rss_growth_kb
+
+    def report(self):
+        """
+        Returns the recorded phases in the order they first ran
+        """
+        return [
+            dict(self.phases[key], phase=key[0], template=key[1])
+            for key in self._order
+        ]
+
+    def print_report(self):
+        print("\n%-16s %-32s %8s %10s %10s %12s" % (
+            'Phase', 'Template', 'Calls', 'Total(s)', 'Max(s)', 'RSS +KB'))
+        for phase in self.report():
+            print("%-16s %-32s %8d %10.3f %10.3f %12d" % (
+                phase['phase'],
+                phase['template'],
+                phase['calls'],
+                phase['seconds'],
+                phase['max_seconds'],
+                phase['rss_growth_kb']))
+        print('')
+
+    def write_json(self, path, action):
+        """
+        @param path [string] file the report is written to
+        @param action [string] create or deploy
+        """
+        with open(path, 'w') as report_file:
+            report_file.write(json.dumps({
+                'action': action,
+                'generated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'peak_rss_kb': self.peak_rss_kb(),
+                'phases': self.report()
+            }, indent=4, sort_keys=True, separators=(',', ': ')))
@@ -1,9 +1,8 @@
 from aws_frederick_common import AWSFrederickCommonTemplate
+from aws_frederick_rds_parameters import AWSFrederickRdsParameterProfile
 from troposphere import Ref
 import troposphere.cloudwatch as cloudwatch
 from troposphere.rds import DBParameterGroup
-import boto3
-import base64
 import pprint
 
 
@@ -36,11 +35,16 @@ class AWSFrederickRdsTemplate(AWSFrederickCommonTemplate):
                 database.get('db_instance_type'),
                 database.get('multiaz'),
                 database.get('encrypt'),
+                database.get('read_replicas', 0),
+                database.get('parameter_profile'),
+                database.get('parameters'),
+                database.get('family'),
                 self.cidr_range,
                 hosted_zone_name
             )
 
-    def add_rds(self, name, engine, username, password, storage, db_instance_type, multiaz, encrypt, cidr, hosted_zone):
+    def add_rds(self, name, engine, username, password, storage, db_instance_type, multiaz, encrypt, read_replicas,
+                parameter_profile, parameters, family, cidr, hosted_zone):
         """
         Helper method creates ingress given a source cidr range and a set of
         ports
@@ -51,6 +55,13 @@ class AWSFrederickRdsTemplate(AWSFrederickCommonTemplate):
         @param storage [int] Sets the size of the database
         @param db_instance_type [string] Instance for the application
         @param multiaz [Bool] Status of if MultiAZ or not
+        @param read_replicas [int] Number of read replicas behind the reader
+        alias
+        @param parameter_profile [string] Workload profile the parameter group
+        is derived from, e.g. nextcloud-oltp
+        @param parameters [dict] Parameters overriding the profile
+        @param family [string] Parameter group family overriding the engine
+        default
         @param cidr [string] Range of addresses for this vpc
         @param hosted_zone [string] Name of the hosted zone the elb will be
         mapped to
@@ -65,22 +76,10 @@ class AWSFrederickRdsTemplate(AWSFrederickCommonTemplate):
 
         private_subnets = [{"Ref": "privateAZ0"}, {"Ref": "privateAZ1"}, {"Ref": "privateAZ2"}]
 
-        if engine == 'postgres':
-            rds_port = 5432
-            family = 'postgres9.5'
-            group_parameters = {
-                'rds.force_ssl': '1',
-                'log_min_duration_statement': '100',
-                'log_statement': 'all'
-            }
-        if engine == 'MySQL':
-            rds_port = 3306
-            family = 'mysql5.1'
-            group_parameters = {}
-        if engine == 'mariadb':
-            rds_port = 3306
-            family = 'mariadb10.0'
-            group_parameters = {}
+        profile = AWSFrederickRdsParameterProfile(engine, db_instance_type, parameter_profile)
+        rds_port = profile.port
+        family = family or profile.family
+        group_parameters = profile.parameters(parameters)
 
         rds_security_group = self.add_simple_sg_with_cidr(name, 'RDSSecurityGroup' + name, 'vpcId', cidr, rds_port, rds_port, 'tcp')
 
@@ -98,12 +97,18 @@ class AWSFrederickRdsTemplate(AWSFrederickCommonTemplate):
         # rds_security_group = self.add_rds_security_group(name, self.vpc_id)
         rds_subnet_group = self.add_rds_db_subnet(name, private_subnets)
 
-        client = boto3.client('kms')
-        response = client.decrypt(CiphertextBlob=base64.b64decode(password))
-        password = response['Plaintext']
+        password = self.get_secret(password)
         print('Master Password is: %s' % password)
         rds_database = self.add_rds_database(name, engine, username, password, storage,
                                              db_instance_type, rds_subnet_group, rds_security_group,
                                              multiaz, rds_parameter_group, encrypt)
 
         self.add_rds_dns_alias(rds_database, name, hosted_zone)
+
+        if read_replicas:
+            replicas = [
+                self.add_rds_read_replica(name, index, rds_database, engine, db_instance_type,
+                                          rds_security_group, rds_parameter_group, len(private_subnets))
+                for index in range(read_replicas)
+            ]
+            self.add_rds_reader_dns_alias(replicas, name, hosted_zone)
@@ -0,0 +1,158 @@
+class AWSFrederickRdsParameterProfile(object):
+    """
+    Derives the DB parameter group for an RDS entry from its engine, its
+    instance class and a workload profile
+    """
+
+    # Port and default parameter group family per engine
+    ENGINES = {
+        'postgres': {'port': 5432, 'family': 'postgres9.5'},
+        'MySQL': {'port': 3306, 'family': 'mysql5.1'},
+        'mariadb': {'port': 3306, 'family': 'mariadb10.0'}
+    }
+
+    # Memory of the RDS instance classes in MiB
+    INSTANCE_MEMORY_MIB = {
+        'db.t2.micro': 1024,
+        'db.t2.small': 2048,
+        'db.t2.medium': 4096,
+        'db.t2.large': 8192,
+        'db.t2.xlarge': 16384,
+        'db.t2.2xlarge': 32768,
+        'db.t3.micro': 1024,
+        'db.t3.small': 2048,
+        'db.t3.medium': 4096,
+        'db.t3.large': 8192,
+        'db.t3.xlarge': 16384,
+        'db.t3.2xlarge': 32768,
+        'db.m4.large': 8192,
+        'db.m4.xlarge': 16384,
+        'db.m4.2xlarge': 32768,
+        'db.m4.4xlarge': 65536,
+        'db.m5.large': 8192,
+        'db.m5.xlarge': 16384,
+        'db.m5.2xlarge': 32768,
+        'db.m5.4xlarge': 65536,
+        'db.r4.large': 15616,
+        'db.r4.xlarge': 31232,
+        'db.r4.2xlarge': 62464,
+        'db.r5.large': 16384,
+        'db.r5.xlarge': 32768,
+        'db.r5.2xlarge': 65536
+    }
+
+    # Parameters every entry gets regardless of the instance size, 'default'
+    # keeps the parameter groups this template always created
+    PROFILES = {
+        'default': {
+            'postgres': {
+                'rds.force_ssl': '1',
+                'log_min_duration_statement': '100',
+                'log_statement': 'all'
+            },
+            'MySQL': {},
+            'mariadb': {}
+        },
+        'nextcloud-oltp': {
+            'postgres': {
+                'rds.force_ssl': '1',
+                'log_min_duration_statement': '1000'
+            },
+            'MySQL': {
+                'slow_query_log': '1',
+                'long_query_time': '1',
+                'log_output': 'FILE'
+            },
+            'mariadb': {
+                'slow_query_log': '1',
+                'long_query_time': '1',
+                'log_output': 'FILE'
+            }
+        }
+    }
+
+    # Profiles that size memory bound parameters to the instance class
+    SIZED_PROFILES = ['nextcloud-oltp']
+
+    def __init__(self, engine, db_instance_type, profile=None):
+        """
+        @param engine [string] postgres, MySQL or mariadb
+        @param db_instance_type [string] RDS instance class, e.g. db.t2.micro
+        @param profile [string] workload profile, defaults to 'default'
+        """
+        profile = profile or 'default'
+        if engine not in self.ENGINES:
+            raise ValueError('Unsupported RDS engine %s' % engine)
+        if profile not in self.PROFILES:
+            raise ValueError('Unknown RDS parameter profile %s, expected one of %s' % (
+                profile, ', '.join(sorted(self.PROFILES))))
+
+        self.engine = engine
+        self.db_instance_type = db_instance_type
+        self.profile = profile
+        self.port = self.ENGINES[engine]['port']
+        self.family = self.ENGINES[engine]['family']
+
+    def memory_mib(self):
+        return self.INSTANCE_MEMORY_MIB.get(self.db_instance_type)
+
+    def sized_parameters(self):
+        """
+        Returns the memory bound parameters for the instance class. Unknown
+        classes fall back to RDS formulas evaluated against the instance
+        memory at launch
+        """
+        memory_mib = self.memory_mib()
+
+        if self.engine == 'postgres':
+            if memory_mib is None:
+                return {
+                    'shared_buffers': '{DBInstanceClassMemory/32768}',
+                    'effective_cache_size': '{DBInstanceClassMemory*3/32768}'
+                }
+            # Both are in 8kB pages, a quarter of memory for shared buffers
+            return {
+                'shared_buffers': str(memory_mib * 1024 / 4 / 8),
+                'effective_cache_size': str(memory_mib * 1024 * 3 / 4 / 8),
+                'max_connections': str(self.max_connections(memory_mib)),
+                'work_mem': str(self.tmp_table_size_mib(memory_mib) * 1024)
+            }
+
+        if memory_mib is None:
+            return {'innodb_buffer_pool_size': '{DBInstanceClassMemory*3/4}'}
+
+        # Small instances keep half their memory for connections and the OS
+        buffer_pool_fraction = 0.75 if memory_mib >= 4096 else 0.5
+        tmp_table_size = self.tmp_table_size_mib(memory_mib) * 1024 * 1024
+        return {
+            'innodb_buffer_pool_size': str(int(memory_mib * buffer_pool_fraction) * 1024 * 1024),
+            'max_connections': str(self.max_connections(memory_mib)),
+            'tmp_table_size': str(tmp_table_size),
+            'max_heap_table_size': str(tmp_table_size)
+        }
+
+    @staticmethod
+    def max_connections(memory_mib):
+        return max(60, min(memory_mib / 12, 2000))
+
+    @staticmethod
+    def tmp_table_size_mib(memory_mib):
+        if memory_mib <= 2048:
+            return 16
+        if memory_mib <= 8192:
+            return 32
+        return 64
+
+    def parameters(self, overrides=None):
+        """
+        Returns the parameter group parameters, overrides win over anything
+        the profile derives
+        @param overrides [dict] parameters set on the rds entry
+        """
+        parameters = dict(self.PROFILES[self.profile][self.engine])
+        if self.profile in self.SIZED_PROFILES:
+            parameters.update(self.sized_parameters())
+
+        for key, value in (overrides or {}).items():
+            parameters[key] = str(value)
+        return parameters
@@ -0,0 +1,158 @@
+from botocore.exceptions import ClientError
+from StringIO import StringIO
+import hashlib
+import zipfile
+import json
+import os
+
+
+class AWSFrederickTemplateCache(object):
+    """
+    Content addressed template uploads. Each template is hashed and only
+    uploaded when neither the local manifest nor the S3 object metadata
+    already records that hash for its key
+    """
+
+    # Outputs environmentbase regenerates on every render
+    VOLATILE_OUTPUTS = ['dateGenerated', 'templateValidationHash']
+
+    # S3 user metadata key holding the content hash of an uploaded template
+    HASH_METADATA_KEY = 'content-sha256'
+
+    def __init__(self, s3_client, bucket, manifest_path, acl=None):
+        """
+        @param s3_client [S3.Client] boto3 s3 client
+        @param bucket [string] name of the template bucket
+        @param manifest_path [string] local file recording uploaded hashes
+        @param acl [string] canned ACL applied to uploaded templates
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.manifest_path = manifest_path
+        self.acl = acl
+        self.manifest = {}
+
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    @staticmethod
+    def content_hash(template_json):
+        """
+        Returns the sha256 of a rendered template, ignoring the outputs that
+        change on every render
+        @param template_json [string] rendered template
+        """
+        template = json.loads(template_json)
+        outputs = template.get('Outputs', {})
+        for output_key in AWSFrederickTemplateCache.VOLATILE_OUTPUTS:
+            outputs.pop(output_key, None)
+        if 'Outputs' in template and not outputs:
+            template.pop('Outputs')
+
+        canonical = json.dumps(template, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical).hexdigest()
+
+    @staticmethod
+    def content_path(prefix, template_name, template_json):
+        """
+        Returns the S3 resource path for a template keyed by its content hash
+        @param prefix [string] S3 path prefix for templates
+        @param template_name [string] name of the template
+        @param template_json [string] rendered template
+        """
+        content_hash = AWSFrederickTemplateCache.content_hash(template_json)
+        return '%s/%s.%s.template' % (prefix, template_name, content_hash[:16])
+
+    def remote_hash(self, key):
+        """
+        Returns the content hash recorded on the S3 object, or None if the
+        object does not exist
+        @param key [string] S3 key of the template
+        """
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return response.get('Metadata', {}).get(self.HASH_METADATA_KEY)
+
+    def upload(self, key, body, content_hash=None):
+        """
+        Uploads a template unless the same content is already stored under
+        its key. Returns True if the template was uploaded
+        @param key [string] S3 key of the template
+        @param body [string] rendered template
+        @param content_hash [string] hash of a body that is not a template,
+        e.g. a lambda package
+        """
+        content_hash = content_hash or self.content_hash(body)
+        bucket_manifest = self.manifest.setdefault(self.bucket, {})
+
+        if bucket_manifest.get(key) == content_hash:
+            return False
+
+        if self.remote_hash(key) == content_hash:
+            bucket_manifest[key] = content_hash
+            return False
+
+        put_args = {
+            'Bucket': self.bucket,
+            'Key': key,
+            'Body': body,
+            'Metadata': {self.HASH_METADATA_KEY: content_hash}
+        }
+        if self.acl:
+            put_args['ACL'] = self.acl
+
+        self.s3_client.put_object(**put_args)
+        bucket_manifest[key] = content_hash
+        return True
+
+    def save(self):
+        with open(self.manifest_path, 'w') as manifest_file:
+            manifest_file.write(json.dumps(self.manifest, indent=4, sort_keys=True, separators=(',', ': ')))
+
+
+class AWSFrederickLambdaPackage(object):
+    """
+    Zip of a lambda/ source directory, stored next to the templates under a
+    content addressed key so an unchanged function is neither uploaded nor
+    updated again
+    """
+
+    # Fixed entry timestamp, zip entries otherwise carry the file mtime and
+    # every checkout would hash differently
+    ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+    def __init__(self, name, source_dir, files):
+        """
+        @param name [string] name of the function the package belongs to
+        @param source_dir [string] directory holding the function's sources
+        @param files [list] files of source_dir that go into the package
+        """
+        self.name = name
+        self.source_dir = source_dir
+        self.files = sorted(files)
+        self.body = self.build()
+        self.content_hash = hashlib.sha256(self.body).hexdigest()
+
+    def build(self):
+        buf = StringIO()
+        package = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
+        for file_name in self.files:
+            with open(os.path.join(self.source_dir, file_name)) as source_file:
+                entry = zipfile.ZipInfo(file_name, date_time=self.ZIP_DATE_TIME)
+                entry.external_attr = 0644 << 16
+                entry.compress_type = zipfile.ZIP_DEFLATED
+                package.writestr(entry, source_file.read())
+        package.close()
+        return buf.getvalue()
+
+    def content_path(self, prefix):
+        """
+        Returns the S3 resource path of the package
+        @param prefix [string] S3 path prefix for templates
+        """
+        return '%s/lambda/%s.%s.zip' % (prefix, self.name, self.content_hash[:16])
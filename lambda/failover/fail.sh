@@ -1 +1,5 @@
-aws cloudwatch set-alarm-state --alarm-name api-mapfrederick-city-awsroute53-8046907e-ed54-4a07-b977-0f2f17a13f74-Low-HealthCheckStatus --state-value ALARM --state-reason 'TestingFail' --profile aws-frederick
+# Forces the failover alarm of an environment into ALARM, the failover
+# function switches the site to maintenance. The alarm returns to OK on the
+# next health check evaluation if the site is healthy.
+ENVIRONMENT_NAME=${1:-aws-frederick}
+aws cloudwatch set-alarm-state --alarm-name ${ENVIRONMENT_NAME}-failover --state-value ALARM --state-reason 'TestingFail' --profile aws-frederick
@@ -1,30 +1,277 @@
+"""
+Maintenance mode failover, invoked by the site health alarm through SNS or
+through an SQS queue subscribed to the alarm's topic. ALARM switches the site
+to maintenance and OK switches it back, other alarm states leave it as it is.
+An invocation acts only on the newest alarm state among its records, so a
+burst of notifications batched from the queue costs at most one switch.
+
+FAILOVER_MODE selects how the site is switched:
+
+route53     UPSERTs the alias record RECORD_NAME in HOSTED_ZONE_NAME to
+            MAINTENANCE_DNS_NAME/MAINTENANCE_ZONE_ID or back to
+            PRIMARY_DNS_NAME/PRIMARY_ZONE_ID. Route53 applies the change
+            within seconds, resolvers follow once the 60 second alias TTL
+            runs out.
+cloudfront  Sets DefaultRootObject of DISTRIBUTION_ID to
+            MAINTENANCE_ROOT_OBJECT or ROOT_OBJECT. The update waits on a
+            full CloudFront deployment, kept for static sites.
+
+The state a switch last saw or applied is cached for CACHE_SECONDS across
+warm invocations, so an alarm for the state the site is already in costs
+no AWS call at all.
+"""
 import boto3
+from botocore.exceptions import ClientError
 import json
 import logging
+import os
+import time
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+PRIMARY = 'primary'
+MAINTENANCE = 'maintenance'
+
+# Alarm state to site state, anything else is ignored
+ALARM_STATES = {
+    'ALARM': MAINTENANCE,
+    'OK': PRIMARY
+}
+
+
+class Route53Switch(object):
+    """
+    Points an alias record at the primary or the maintenance target
+    """
+
+    def __init__(self, client, env):
+        self.client = client
+        self.zone_name = env['HOSTED_ZONE_NAME']
+        self.record_name = env['RECORD_NAME'].rstrip('.') + '.'
+        self.record_type = env.get('RECORD_TYPE', 'A')
+        self.cache_seconds = int(env.get('CACHE_SECONDS', 300))
+        self.targets = {
+            PRIMARY: (env['PRIMARY_DNS_NAME'], env['PRIMARY_ZONE_ID']),
+            MAINTENANCE: (env['MAINTENANCE_DNS_NAME'], env['MAINTENANCE_ZONE_ID'])
+        }
+        self.zone_id = None
+        self.state = None
+        self.state_time = 0
+
+    @staticmethod
+    def normalize(dns_name):
+        return dns_name.rstrip('.').lower()
+
+    def hosted_zone_id(self):
+        """
+        Returns the id of the public zone named HOSTED_ZONE_NAME. A private
+        zone of the same name is skipped, the site record lives in the
+        public one
+        """
+        if self.zone_id is None:
+            zones = self.client.list_hosted_zones_by_name(DNSName=self.zone_name, MaxItems='100')['HostedZones']
+            public_zones = [
+                zone for zone in zones
+                if self.normalize(zone['Name']) == self.normalize(self.zone_name)
+                and not zone.get('Config', {}).get('PrivateZone', False)
+            ]
+            if not public_zones:
+                raise ValueError('No public hosted zone named %s' % self.zone_name)
+            self.zone_id = public_zones[0]['Id'].split('/')[-1]
+        return self.zone_id
+
+    def observe(self):
+        """
+        Returns the state the record currently points at, None when it
+        points at neither target
+        """
+        records = self.client.list_resource_record_sets(
+            HostedZoneId=self.hosted_zone_id(),
+            StartRecordName=self.record_name,
+            StartRecordType=self.record_type,
+            MaxItems='1')['ResourceRecordSets']
+
+        for record in records:
+            if self.normalize(record['Name']) != self.normalize(self.record_name):
+                continue
+            dns_name = self.normalize(record.get('AliasTarget', {}).get('DNSName', ''))
+            for state, (target, _) in self.targets.items():
+                if dns_name == self.normalize(target):
+                    return state
+        return None
+
+    def current_state(self):
+        if self.state is None or time.time() - self.state_time > self.cache_seconds:
+            self.state = self.observe()
+            self.state_time = time.time()
+        return self.state
+
+    def apply(self, state):
+        """
+        Returns True if the record was changed
+        """
+        if self.current_state() == state:
+            return False
+
+        dns_name, zone_id = self.targets[state]
+        self.client.change_resource_record_sets(
+            HostedZoneId=self.hosted_zone_id(),
+            ChangeBatch={
+                'Comment': 'Failover to %s' % state,
+                'Changes': [{
+                    'Action': 'UPSERT',
+                    'ResourceRecordSet': {
+                        'Name': self.record_name,
+                        'Type': self.record_type,
+                        'AliasTarget': {
+                            'HostedZoneId': zone_id,
+                            'DNSName': dns_name,
+                            'EvaluateTargetHealth': False
+                        }
+                    }
+                }]
+            })
+        self.state = state
+        self.state_time = time.time()
+        return True
+
+
+class CloudFrontSwitch(object):
+    """
+    Flips the default root object of a distribution. The config and its ETag
+    are kept between invocations and only fetched again when they expire or
+    the ETag no longer matches
+    """
+
+    def __init__(self, client, env):
+        self.client = client
+        self.distribution_id = env['DISTRIBUTION_ID']
+        self.cache_seconds = int(env.get('CACHE_SECONDS', 300))
+        self.root_objects = {
+            PRIMARY: env.get('ROOT_OBJECT', 'index.html'),
+            MAINTENANCE: env.get('MAINTENANCE_ROOT_OBJECT', 'maint.html')
+        }
+        self.config = None
+        self.etag = None
+        self.config_time = 0
+
+    def refresh(self):
+        response = self.client.get_distribution_config(Id=self.distribution_id)
+        self.config = response['DistributionConfig']
+        self.etag = response['ETag']
+        self.config_time = time.time()
+
+    def current_state(self):
+        if self.config is None or time.time() - self.config_time > self.cache_seconds:
+            self.refresh()
+        for state, root_object in self.root_objects.items():
+            if self.config.get('DefaultRootObject') == root_object:
+                return state
+        return None
+
+    def apply(self, state):
+        """
+        Returns True if the distribution was updated. A stale ETag is fetched
+        again once, the update is dropped if the fresh config already has the
+        requested state
+        """
+        if self.current_state() == state:
+            return False
+
+        for attempt in range(2):
+            config = dict(self.config, DefaultRootObject=self.root_objects[state])
+            try:
+                response = self.client.update_distribution(
+                    DistributionConfig=config,
+                    Id=self.distribution_id,
+                    IfMatch=self.etag)
+            except ClientError as e:
+                if attempt or e.response.get('Error', {}).get('Code') != 'PreconditionFailed':
+                    raise
+                logger.info('Distribution %s changed underneath, reloading', self.distribution_id)
+                self.refresh()
+                if self.current_state() == state:
+                    return False
+                continue
+
+            self.config = response['Distribution']['DistributionConfig']
+            self.etag = response['ETag']
+            self.config_time = time.time()
+            return True
+
+
+SWITCHES = {
+    'route53': (Route53Switch, 'route53'),
+    'cloudfront': (CloudFrontSwitch, 'cloudfront')
+}
+
+# Built on the first invocation and reused while the container is warm
+switch = None
+
+# StateChangeTime of the newest alarm acted on, queued notifications are not
+# ordered and a late one must not undo a newer state
+last_change_time = None
+
+
+def get_switch(env=None):
+    global switch
+    if switch is None:
+        env = env if env is not None else os.environ
+        switch_class, service = SWITCHES[env.get('FAILOVER_MODE', 'route53')]
+        switch = switch_class(boto3.client(service), env)
+    return switch
+
+
+def alarm_message(record):
+    """
+    Returns the alarm notification of an SNS record or of an SQS record
+    holding an SNS envelope
+    """
+    if 'Sns' in record:
+        return json.loads(record['Sns']['Message'])
+    return json.loads(json.loads(record['body'])['Message'])
+
+
+def latest_alarm(records):
+    """
+    Returns (site state, StateChangeTime) of the newest record carrying a
+    known alarm state. Records without a StateChangeTime are ordered by
+    position
+    """
+    latest = None
+    for index, record in enumerate(records):
+        message = alarm_message(record)
+        state = ALARM_STATES.get(message.get('NewStateValue'))
+        if state is None:
+            continue
+        key = (message.get('StateChangeTime', ''), index)
+        if latest is None or key >= latest[0]:
+            latest = (key, state)
+
+    if latest is None:
+        return None, None
+    return latest[1], latest[0][0] or None
+
 
 def lambda_handler(event, context):
-    message = json.loads(event['Records'][0]['Sns']['Message'])
-    cloudfront_id = 'E331D9A4QW76J0'
-    client = boto3.client('cloudfront')
-    if message['NewStateValue'] == 'ALARM':
-        logger.info('Entering Maintaince Mode')
-        cf_cfg = client.get_distribution_config(Id=cloudfront_id)
-        cf_cfg['DistributionConfig']['DefaultRootObject'] = 'maint.html'
-        response = client.update_distribution(DistributionConfig=cf_cfg['DistributionConfig'],
-                                                 Id=cloudfront_id,
-                                                 IfMatch=cf_cfg['ETag'])
-        logger.info(response)
+    global last_change_time
+
+    state, change_time = latest_alarm(event['Records'])
+    if state is None:
+        logger.info('No alarm state to act on')
+        return {'state': None, 'changed': False}
+
+    # StateChangeTime is ISO 8601 in UTC, newer sorts later
+    if change_time and last_change_time and change_time < last_change_time:
+        logger.info('Ignoring %s from %s, superseded by %s', state, change_time, last_change_time)
+        return {'state': None, 'changed': False}
+    last_change_time = change_time or last_change_time
+
+    changed = get_switch().apply(state)
+    if changed:
+        logger.info('Switched to %s', state)
     else:
-        logger.info('Leaving Maintaince Mode')
-        cf_cfg = client.get_distribution_config(Id=cloudfront_id)
-        cf_cfg['DistributionConfig']['DefaultRootObject'] = 'index.html'
-        response = client.update_distribution(DistributionConfig=cf_cfg['DistributionConfig'],
-                                                 Id=cloudfront_id,
-                                                 IfMatch=cf_cfg['ETag'])
-        logger.info(response)
-
-    return 0
+        logger.info('Already in %s, nothing to do', state)
+
+    return {'state': state, 'changed': changed}
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+'''
+Usage:
+    simulate.py [--mode <MODE>] [--events <COUNT>] [--flap <PERCENT>]
+    [--latency <MS>] [--seed <SEED>]
+
+Options:
+  -h --help                            Show this screen.
+  --mode <MODE>                        route53, cloudfront or all
+                                       [default: all].
+  --events <COUNT>                     Alarm notifications per scenario
+                                       [default: 200].
+  --flap <PERCENT>                     Chance that a notification in the
+                                       flapping storm changes the alarm
+                                       state [default: 50].
+  --latency <MS>                       Simulated latency of every stubbed
+                                       AWS call [default: 0].
+  --seed <SEED>                        Seed for the flapping storm
+                                       [default: 1].
+'''
+
+from botocore.exceptions import ClientError
+from docopt import docopt
+import random
+import copy
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main
+
+
+class StubClient(object):
+    """
+    Counts the calls made through a stubbed client and the updates that did
+    not change anything
+    """
+
+    def __init__(self, latency):
+        """
+        @param latency [float] seconds every call takes
+        """
+        self.latency = latency
+        self.calls = {}
+        self.redundant_updates = 0
+        self.conflicts = 0
+
+    def call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def call_count(self):
+        return sum(self.calls.values())
+
+
+class StubCloudFront(StubClient):
+    """
+    One distribution whose ETag changes on every update, as CloudFront's does
+    """
+
+    def __init__(self, latency, root_object='index.html'):
+        super(StubCloudFront, self).__init__(latency)
+        self.config = {'DefaultRootObject': root_object, 'Enabled': True, 'Comment': 'simulated'}
+        self.version = 1
+
+    @property
+    def etag(self):
+        return 'E%d' % self.version
+
+    def get_distribution_config(self, Id):
+        self.call('get_distribution_config')
+        return {'DistributionConfig': copy.deepcopy(self.config), 'ETag': self.etag}
+
+    def update_distribution(self, DistributionConfig, Id, IfMatch):
+        self.call('update_distribution')
+        if IfMatch != self.etag:
+            self.conflicts += 1
+            raise ClientError(
+                {'Error': {'Code': 'PreconditionFailed', 'Message': 'The If-Match version is missing or not valid'}},
+                'UpdateDistribution')
+
+        if DistributionConfig == self.config:
+            self.redundant_updates += 1
+        self.external_update(DistributionConfig['DefaultRootObject'])
+        return {'Distribution': {'DistributionConfig': copy.deepcopy(self.config)}, 'ETag': self.etag}
+
+    def external_update(self, root_object):
+        """
+        Changes the distribution outside of the handler, e.g. a stack update
+        """
+        self.config = dict(self.config, DefaultRootObject=root_object)
+        self.version += 1
+
+    def state(self, env):
+        if self.config['DefaultRootObject'] == env['MAINTENANCE_ROOT_OBJECT']:
+            return main.MAINTENANCE
+        return main.PRIMARY
+
+
+class StubRoute53(StubClient):
+    """
+    A public hosted zone holding the site's alias record and an empty
+    private zone of the same name
+    """
+
+    ZONE_ID = 'ZSIMULATED'
+
+    def __init__(self, latency, record_name, dns_name, zone_id):
+        super(StubRoute53, self).__init__(latency)
+        self.record = {
+            'Name': record_name,
+            'Type': 'A',
+            'AliasTarget': {'HostedZoneId': zone_id, 'DNSName': dns_name + '.', 'EvaluateTargetHealth': False}
+        }
+
+    def list_hosted_zones_by_name(self, DNSName, MaxItems):
+        self.call('list_hosted_zones_by_name')
+        # The private zone of the same name comes first, as it can in AWS
+        return {'HostedZones': [
+            {'Id': '/hostedzone/ZPRIVATE', 'Name': DNSName, 'Config': {'PrivateZone': True}},
+            {'Id': '/hostedzone/' + self.ZONE_ID, 'Name': DNSName, 'Config': {'PrivateZone': False}}
+        ]}
+
+    def list_resource_record_sets(self, HostedZoneId, StartRecordName, StartRecordType, MaxItems):
+        self.call('list_resource_record_sets')
+        self.check_zone(HostedZoneId)
+        return {'ResourceRecordSets': [copy.deepcopy(self.record)]}
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        self.call('change_resource_record_sets')
+        self.check_zone(HostedZoneId)
+        record_set = ChangeBatch['Changes'][0]['ResourceRecordSet']
+        alias_target = dict(record_set['AliasTarget'], DNSName=record_set['AliasTarget']['DNSName'].rstrip('.') + '.')
+        if alias_target == self.record['AliasTarget']:
+            self.redundant_updates += 1
+        self.external_update(alias_target)
+        return {'ChangeInfo': {'Id': '/change/CSIMULATED', 'Status': 'PENDING'}}
+
+    def check_zone(self, zone_id):
+        if zone_id != self.ZONE_ID:
+            raise AssertionError('Record accessed in hosted zone %s instead of %s' % (zone_id, self.ZONE_ID))
+
+    def external_update(self, alias_target):
+        self.record = dict(self.record, AliasTarget=alias_target)
+
+    def state(self, env):
+        if self.record['AliasTarget']['DNSName'].rstrip('.') == env['MAINTENANCE_DNS_NAME']:
+            return main.MAINTENANCE
+        return main.PRIMARY
+
+
+class FailoverSimulation(object):
+    """
+    Replays alarm notification sequences against lambda_handler with stubbed
+    AWS clients. Every scenario checks that the site ends up in the state of
+    the last alarm and that no update was issued for a state the site was
+    already in
+    """
+
+    ENVIRONMENTS = {
+        'route53': {
+            'FAILOVER_MODE': 'route53',
+            'HOSTED_ZONE_NAME': 'filesharefrederick.net.',
+            'RECORD_NAME': 'filesharefrederick.net.',
+            'PRIMARY_DNS_NAME': 'dprimary.cloudfront.net',
+            'PRIMARY_ZONE_ID': 'Z2FDTNDATAQYW2',
+            'MAINTENANCE_DNS_NAME': 'dmaintenance.cloudfront.net',
+            'MAINTENANCE_ZONE_ID': 'Z2FDTNDATAQYW2',
+            'CACHE_SECONDS': '300'
+        },
+        'cloudfront': {
+            'FAILOVER_MODE': 'cloudfront',
+            'DISTRIBUTION_ID': 'ESIMULATED',
+            'ROOT_OBJECT': 'index.html',
+            'MAINTENANCE_ROOT_OBJECT': 'maint.html',
+            'CACHE_SECONDS': '300'
+        }
+    }
+
+    def __init__(self, events, flap, latency, seed):
+        """
+        @param events [int] alarm notifications per scenario
+        @param flap [int] percent chance a storm notification changes state
+        @param latency [float] seconds every stubbed call takes
+        @param seed [int] seed of the flapping storm
+        """
+        self.events = events
+        self.flap = flap
+        self.latency = latency
+        self.seed = seed
+
+    def stub_client(self, mode):
+        env = self.ENVIRONMENTS[mode]
+        if mode == 'route53':
+            return StubRoute53(self.latency, env['RECORD_NAME'], env['PRIMARY_DNS_NAME'], env['PRIMARY_ZONE_ID'])
+        return StubCloudFront(self.latency, env['ROOT_OBJECT'])
+
+    @staticmethod
+    def notification(sequence, state, queued):
+        """
+        Returns the record delivering the sequence-th alarm notification,
+        queued ones arrive as SNS envelopes in SQS records
+        """
+        message = json.dumps({
+            'AlarmName': 'aws-frederick-failover',
+            'NewStateValue': state,
+            'NewStateReason': 'simulated',
+            'StateChangeTime': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1500000000 + sequence)) + '.000+0000'
+        })
+
+        if not queued:
+            return {'EventSource': 'aws:sns', 'Sns': {'Message': message}}
+        return {
+            'eventSource': 'aws:sqs',
+            'body': json.dumps({'Type': 'Notification', 'Message': message})
+        }
+
+    def storm(self):
+        """
+        Returns a flapping ALARM/OK sequence with the odd INSUFFICIENT_DATA
+        as (sequence, state)
+        """
+        rng = random.Random(self.seed)
+        state = 'ALARM'
+        states = []
+        for sequence in range(self.events):
+            if rng.randint(1, 100) <= self.flap:
+                state = 'OK' if state == 'ALARM' else 'ALARM'
+            states.append((sequence, 'INSUFFICIENT_DATA' if rng.randint(1, 100) <= 5 else state))
+        return states
+
+    def queued(self, storm):
+        """
+        Returns the storm as the SQS event source delivers it, in batches of
+        up to 10 without ordering and with the first notification of each
+        batch delivered again in the next one
+        """
+        rng = random.Random(self.seed)
+        batches = [storm[ii:ii + 10] for ii in range(0, len(storm), 10)]
+        for ii in range(len(batches) - 1, 0, -1):
+            batches[ii] = batches[ii] + batches[ii - 1][:1]
+        for batch in batches:
+            rng.shuffle(batch)
+        return batches
+
+    def scenarios(self, mode):
+        """
+        Returns (name, [[(sequence, alarm state), ...] per invocation],
+        queued, external change before invocation index or None)
+        """
+        storm = self.storm()
+        half = self.events // 2
+        scenarios = [
+            ('duplicate-alarm', [[(0, 'ALARM')]] * self.events, False, None),
+            ('recover', [[(0, 'ALARM')]] * half + [[(1, 'OK')]] * (self.events - half), False, None),
+            ('flapping-storm', [[event] for event in storm], False, None),
+            ('batched-storm', [storm[ii:ii + 10] for ii in range(0, len(storm), 10)], False, None),
+            ('queued-storm', self.queued(storm), True, None)
+        ]
+
+        if mode == 'cloudfront':
+            # Someone else updates the distribution mid storm, the cached
+            # ETag is stale and the handler must reload it
+            scenarios.append(('etag-conflict', [[event] for event in storm], False, half))
+        return scenarios
+
+    @staticmethod
+    def expected_state(invocations):
+        """
+        Returns the state after the invocations and the number of switches,
+        each invocation acting on its newest notification unless a newer one
+        was acted on before
+        """
+        state = main.PRIMARY
+        applied = -1
+        transitions = 0
+        for events in invocations:
+            known = [(sequence, s) for sequence, s in events if s in main.ALARM_STATES]
+            if not known:
+                continue
+            sequence, alarm_state = max(known)
+            if sequence < applied:
+                continue
+            applied = sequence
+            if main.ALARM_STATES[alarm_state] != state:
+                state = main.ALARM_STATES[alarm_state]
+                transitions += 1
+        return state, transitions
+
+    def run_scenario(self, mode, invocations, queued, conflict_at):
+        env = self.ENVIRONMENTS[mode]
+        client = self.stub_client(mode)
+        main.switch = main.SWITCHES[mode][0](client, env)
+        main.last_change_time = None
+
+        latencies = []
+        changes = 0
+        for index, events in enumerate(invocations):
+            if index == conflict_at:
+                # Same content under a new ETag
+                client.external_update(client.config['DefaultRootObject'])
+
+            event = {'Records': [self.notification(sequence, state, queued) for sequence, state in events]}
+            start = time.time()
+            result = main.lambda_handler(event, None)
+            latencies.append(time.time() - start)
+            changes += 1 if result['changed'] else 0
+
+        expected_state, transitions = self.expected_state(invocations)
+        latencies.sort()
+        return {
+            'invocations': len(invocations),
+            'transitions': transitions,
+            'changes': changes,
+            'api_calls': client.call_count(),
+            'redundant_updates': client.redundant_updates,
+            'conflicts': client.conflicts,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'final_state': client.state(env),
+            'expected_state': expected_state
+        }
+
+    @staticmethod
+    def failures(result):
+        found = []
+        if result['final_state'] != result['expected_state']:
+            found.append('ended in %s instead of %s' % (result['final_state'], result['expected_state']))
+        if result['redundant_updates']:
+            found.append('%d redundant updates' % result['redundant_updates'])
+        if result['changes'] != result['transitions']:
+            found.append('%d changes for %d transitions' % (result['changes'], result['transitions']))
+        return found
+
+    def run(self, modes):
+        """
+        Runs every scenario of every mode, returns the number of failed
+        scenarios
+        """
+        print("%-11s %-16s %6s %6s %6s %6s %9s %9s %9s %9s" % (
+            'Mode', 'Scenario', 'Calls', 'Trans', 'Change', 'API', 'Redundant', 'Conflicts', 'p50(ms)', 'max(ms)'))
+
+        failed = 0
+        for mode in modes:
+            for name, invocations, queued, conflict_at in self.scenarios(mode):
+                result = self.run_scenario(mode, invocations, queued, conflict_at)
+                print("%-11s %-16s %6d %6d %6d %6d %9d %9d %9.2f %9.2f" % (
+                    mode,
+                    name,
+                    result['invocations'],
+                    result['transitions'],
+                    result['changes'],
+                    result['api_calls'],
+                    result['redundant_updates'],
+                    result['conflicts'],
+                    result['p50_ms'],
+                    result['max_ms']))
+
+                for failure in self.failures(result):
+                    print("  FAILED %s" % failure)
+                    failed += 1
+        return failed
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    # The handler logs every invocation, keep the table readable
+    main.logger.disabled = True
+
+    modes = ['route53', 'cloudfront'] if args['--mode'] == 'all' else [args['--mode']]
+    simulation = FailoverSimulation(
+        int(args['--events']),
+        int(args['--flap']),
+        int(args['--latency']) / 1000.0,
+        int(args['--seed'])
+    )
+
+    sys.exit(1 if simulation.run(modes) else 0)
@@ -7,7 +7,9 @@ apt-get update -y
 apt-get install apache2 libapache2-mod-php7.0 -y
 apt-get install php7.0-gd php7.0-json php7.0-mysql php7.0-curl php7.0-mbstring -y
 apt-get install php7.0-intl php7.0-mcrypt php-imagick php7.0-xml php7.0-zip php7.0-ldap -y
+apt-get install php-redis -y
 apt-get install mariadb-client-core-10.0 -y
+apt-get install nfs-common cachefilesd -y
 
 ### Setup Database ###
 if [[ $DATABASE == 'true' ]];  then